@@ -1,26 +1,45 @@
-from utils import resource_path
+from inference import LocalDetector, RemoteDetector, inference_server_worker, MAX_FRAME_BYTES
+from frame_buffer import FrameRing, FrameHub
+from detection_db import open_db, init_schema, to_epoch_ms, DetectionWriter, RetentionPruner, ROLLUP_TABLES
+from columnar_export import ARROW_COLUMNS, stream_columnar
+from reports import build_pdf_report, require_reportlab
+from jobs import JobRunner
+from ws_fanout import ClientGroup
+from subscriptions import EventSubscription, UpdateCoalescer
+from wire import encode
+from capture import LatestFrameCapture
+from motion import MotionGate
+from zones import ZoneIndex
 from datetime import datetime
 from logger import get_logger
 import numpy as np
 import threading
 import asyncio
-import sqlite3
 import base64
 import queue
 import json
+import zlib
+import tempfile
 import time
 import cv2
 import csv
 import io
 import os
 
-from multiprocessing import Manager, Process
-from ultralytics import YOLO
+from multiprocessing import Manager, Process, Condition, Queue, Pipe, shared_memory
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-TRACKER_YAML = resource_path("Ressources/bytetrack.yaml")
-YOLO_WEIGHTS = resource_path("Ressources/yolov8n.pt")
 DB_PATH = os.path.join(BASE_DIR, "detections.db")
+CSV_COLUMNS = ["id", "label", "class", "track_id", "confidence", "x1", "y1", "x2", "y2", "date", "time", "event"]
+# Columns /api/detections may select; id and ts are always returned (they make up the cursor)
+DETECTION_COLUMNS = CSV_COLUMNS + ["ts", "zone_id"]
+# Export job format -> (download filename, media type)
+EXPORT_FILES = {
+    "csv": ("detections.csv", "text/csv; charset=utf-8"),
+    "parquet": ("detections.parquet", "application/vnd.apache.parquet"),
+    "arrow": ("detections.arrows", "application/vnd.apache.arrow.stream"),
+    "pdf": ("detections.pdf", "application/pdf"),
+}
 
 logger = get_logger()
 
@@ -31,157 +50,296 @@ def _now_local_strs():
     return t.strftime("%Y-%m-%d"), t.strftime("%H:%M:%S")
 
 
+def _boxes_to_numpy(boxes):
+    """Ultralytics Boxes (torch or numpy backed) -> one float ndarray, or None."""
+    if boxes is None:
+        return None
+    data = boxes.data
+    return data.cpu().numpy() if hasattr(data, "cpu") else np.asarray(data)
+
+
+def _class_bucket_lut(names, detection_classes):
+    """Array mapping class id -> index of the first detection_classes bucket listing it (-1 = none)."""
+    size = max(names.keys(), default=-1) + 1
+    lut = np.full(size, -1, dtype=np.int64)
+    for cls_id, cls_name in names.items():
+        for j, class_list in enumerate(detection_classes.values()):
+            if cls_name in class_list:
+                lut[cls_id] = j
+                break
+    return lut
+
+
+# Per-frame event message from camera_worker to the broadcaster:
+#   (label, ts_ms, date, time, records, counts | None)
+# counts is the camera's per-task counts dict, included only when it changed
+# with one tuple per event in records:
+#   (EV_APPEAR, track_id, class, zone_id, conf, x1, y1, x2, y2, thumbnail webp bytes | None)
+#   (EV_UPDATE, track_id, class, zone_id, conf, x1, y1, x2, y2)
+#   (EV_LOST, track_id)
+EV_APPEAR, EV_UPDATE, EV_LOST = 0, 1, 2
+EVENT_NAMES = {EV_APPEAR: "appear", EV_UPDATE: "update", EV_LOST: "lost"}
+
+
+def _decode_frame_events(message):
+    """Expand one per-frame event message into the event dicts sent to clients and the DB."""
+    label, ts_ms, date_s, time_s, records, _counts = message
+    for rec in records:
+        kind = rec[0]
+        if kind == EV_LOST:
+            yield {"event": "lost", "label": label, "track_id": rec[1], "date": date_s, "time": time_s}
+            continue
+        evt = {
+            "event": EVENT_NAMES[kind],
+            "type": rec[2],
+            "label": label,
+            "zone_id": rec[3],
+            "track_id": rec[1],
+            "confidence": rec[4],
+            "bbox": list(rec[5:9]),
+            "date": date_s,
+            "time": time_s,
+            "ts": ts_ms,
+        }
+        if kind == EV_APPEAR and rec[9]:
+            evt["thumbnail"] = rec[9]  # raw bytes; base64'd only when rendered as JSON (see wire.encode)
+            evt["mime"] = "image/webp"
+        yield evt
+
+
 def camera_worker(
     ip_address,
     label,
-    frame_store,
-    count_store,
+    frame_ring_name,
+    frame_cond,
     detection_classes,
     colors,
-    last_frame_time,
     event_queue,
-    zones_store,
+    stats_store,
+    control_queue,
     conf_threshold=0.35,
     min_box_area=20 * 20,
     thumbnail_side=128,
     imgsz=640,
-    live_flush_grabs=2,     # for RTSP/USB live streams, drop up to N old frames each tick
+    stats_interval=1.0,     # seconds between pushes to stats_store
+    motion_gate=False,      # skip YOLO when the frame (or its zones) is static
+    motion_threshold=0.002,  # fraction of changed pixels that counts as motion
+    motion_method="diff",   # "diff" (frame differencing) or "mog2" (background subtractor)
+    motion_zones_only=True,
+    motion_max_skip_sec=5.0,  # still infer at least this often so tracks don't go stale
+    roi_mode=False,         # with zones set, only infer the zones' bounding box
+    roi_margin=16,          # pixels of context kept around the zones
+    inference_channel=None,  # (request_queue, response_conn, slot, input_name) -> use the inference server
+    capture_options=None,   # LatestFrameCapture options: backend, substream, keyframes_only, hwaccel, decode_threads
 ):
     print(f"[WORKER] Camera '{label}' connecting to {ip_address}")
-    if isinstance(ip_address, str) and ip_address.isdigit():
-        ip_address = int(ip_address)  # treat "0" or "1" as webcam index
-    cap = cv2.VideoCapture(ip_address)
-    
-    # Smaller buffer for live streams helps keep latency low
-    try:
-        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    except Exception:
-        pass
-
-    # Model in Ressources/
-    model = YOLO(YOLO_WEIGHTS)
-
-    try:
-        _ = model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
-    except Exception:
-        pass
+    # Decoding runs on its own thread; this loop always takes the freshest frame
+    capture = LatestFrameCapture(ip_address, label, **(capture_options or {}))
+    capture.start()
+
+    # Annotated JPEGs go straight into the shared-memory ring owned by the API process
+    frame_ring = FrameRing.attach(frame_ring_name)
+    oversize_warned = False
+
+    # Either a model of our own (Ressources/) or a client of the shared inference server
+    if inference_channel is not None:
+        detector = RemoteDetector(label, *inference_channel, imgsz=imgsz)
+    else:
+        detector = LocalDetector(label, imgsz=imgsz)
 
     # Stable dashboard keys
     task_keys = tuple(detection_classes.keys())
-    count_store[label] = {k: 0 for k in task_keys}
+    last_counts = {k: 0 for k in task_keys}
+    event_queue.put((label, int(time.time() * 1000), *_now_local_strs(), [], last_counts))
+
+    # class id -> index into task_keys (-1 = not counted), rebuilt when the model's names change
+    bucket_lut, lut_names = None, None
 
     # Track state
     seen_ids = set()
     prev_active_ids = set()
 
-    is_file = isinstance(ip_address, str) and os.path.isfile(ip_address)
-
-    while cap.isOpened():
-        # For live sources, optionally drop a couple of stale frames quickly to reduce lag
-        if not is_file and live_flush_grabs > 0:
-            for _ in range(live_flush_grabs):
-                cap.grab()
+    # Zones arrive precompiled-on-receipt through control_queue whenever set_zones changes them
+    zone_index = ZoneIndex()
+
+    # Inference rate (set by CameraManager's scheduler; None = every frame)
+    target_fps = None
+    next_infer_at = 0.0
+    last_activity = 0.0
+    overlay = []  # (track_id or None, color, text) per box of the last inferred frame
+
+    # Optional motion gate in front of the detector
+    gate = MotionGate(threshold=motion_threshold, method=motion_method, zones_only=motion_zones_only) if motion_gate else None
+    last_infer_time = 0.0
+    infer_interval = 0.0  # seconds between the last two inferences = one tracker step
+    last_motion = 0.0
+    motion_skipped = 0
+
+    # Capture/processing stats
+    inferences = 0
+    frame_seq = 0
+    latency_ema = None
+    stats_due = time.monotonic() + stats_interval
+    last_stats = (time.monotonic(), 0, 0, 0)
+
+    def _publish_frame():
+        nonlocal oversize_warned, latency_ema, stats_due, last_stats
+        # encode annotated frame for MJPEG
+        ok_jpg, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if ok_jpg:
+            if frame_ring.publish(buffer):
+                # wake the API process' FrameHub for this camera
+                with frame_cond:
+                    frame_cond.notify_all()
+            elif not oversize_warned:
+                print(f"[WARNING] '{label}' frame of {buffer.nbytes} bytes exceeds ring slot size; dropped.")
+                oversize_warned = True
+
+        # glass-to-glass (capture -> published MJPEG) latency, smoothed
+        latency = time.time() - captured_at
+        latency_ema = latency if latency_ema is None else 0.9 * latency_ema + 0.1 * latency
+
+        now_mono = time.monotonic()
+        if now_mono >= stats_due:
+            cap_stats = capture.stats()
+            t0, captured0, processed0, inferences0 = last_stats
+            elapsed = max(1e-6, now_mono - t0)
+            stats_store[label] = {
+                **cap_stats,
+                "inferences": inferences,
+                "motion_skipped": motion_skipped,
+                "motion_score": round(gate.last_score, 5) if gate is not None else None,
+                "last_motion": last_motion,
+                "capture_fps": round((cap_stats["captured"] - captured0) / elapsed, 2),
+                "process_fps": round((cap_stats["processed"] - processed0) / elapsed, 2),
+                "inference_fps": round((inferences - inferences0) / elapsed, 2),
+                "target_fps": target_fps,
+                "active_tracks": len(prev_active_ids),
+                "last_activity": last_activity,
+                "latency_ms": round(latency_ema * 1000, 1),
+            }
+            last_stats = (now_mono, cap_stats["captured"], cap_stats["processed"], inferences)
+            stats_due = now_mono + stats_interval
 
-        ok_read, frame = cap.read()
-        if not ok_read:
-            if is_file:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                continue
-            print(f"[WORKER] Camera '{label}': Frame read failed or end of stream.")
+    stopping = False
+    while not stopping:
+        # ---- Control messages from the API process ----
+        while True:
+            try:
+                cmd, value = control_queue.get_nowait()
+            except queue.Empty:
+                break
+            except (EOFError, OSError):
+                break
+            if cmd == "stop":
+                stopping = True
+            elif cmd == "rate":
+                target_fps = value
+                next_infer_at = min(next_infer_at, time.monotonic() + 1.0 / target_fps) if target_fps else 0.0
+            elif cmd == "zones":
+                zone_index = ZoneIndex(value)
+                if gate is not None:
+                    gate.set_zones(value)
+        if stopping:
             break
 
-        # Downscale the frame to a manageable size immediately to prevent MemoryError
-        target_width = 640
-        if frame.shape[1] > target_width:
-            aspect_ratio = frame.shape[1] / frame.shape[0]
-            target_height = int(target_width / aspect_ratio)
-            frame = cv2.resize(frame, (target_width, target_height), interpolation=cv2.INTER_AREA)
-
-        # ---- Inference / tracking (use YAML if present) ----
-        try:
-            if os.path.isfile(TRACKER_YAML):
-                results = model.track(
-                    source=frame,
-                    persist=True,
-                    tracker=TRACKER_YAML,
-                    imgsz=imgsz,
-                    verbose=False,
-                    stream=False,
-                )[0]
-            else:
-                results = model.predict(source=frame, imgsz=imgsz, verbose=False, stream=False, tracker=None)[0]
-        except Exception as e:
-            print(f"[WORKER] '{label}' track() error: {e}")
-            try:
-                model.predictor.args.tracker = None
-            except Exception:
-                pass
-            results = model.predict(source=frame, imgsz=imgsz, verbose=False, stream=False)[0]
+        item = capture.read(frame_seq, timeout=1.0)
+        if item is None:
+            if capture.ended:
+                break
+            continue
+        frame_seq, captured_at, frame = item
+
+        # ---- Rate scheduling / motion gating: skipped frames show the tracks' predicted boxes ----
+        now_mono = time.monotonic()
+        skip = bool(target_fps) and now_mono < next_infer_at
+        if not skip:
+            next_infer_at = now_mono + (1.0 / target_fps if target_fps else 0.0)
+        if not skip and gate is not None:
+            if gate.check(frame):
+                last_motion = time.time()
+            elif now_mono - last_infer_time < motion_max_skip_sec:
+                motion_skipped += 1
+                skip = True
+        if skip:
+            # move tracked boxes along their Kalman velocity; untracked ones would only be stale
+            if overlay:
+                alpha = min((now_mono - last_infer_time) / infer_interval, 2.0) if infer_interval > 0 else 0.0
+                predicted = detector.predict_tracks(alpha)
+                for tid, color, text in overlay:
+                    box = predicted.get(tid)
+                    if box is None:
+                        continue
+                    x1, y1, x2, y2 = (int(round(v)) for v in box)
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                    cv2.putText(frame, text, (x1, max(10, y1 - 8)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+            _publish_frame()
+            continue
+        if last_infer_time:
+            infer_interval = now_mono - last_infer_time
+        last_infer_time = now_mono
+
+        # ---- Inference / tracking (optionally on the zones' ROI only) ----
+        roi = zone_index.bbox(frame.shape, roi_margin) if roi_mode else None
+        boxes = detector.detect(frame, roi=roi)
+        names = detector.names or {}
+        inferences += 1
 
         # ---- Per-frame counts ----
         counts = {k: 0 for k in task_keys}
         active_ids = set()
-
-        zones_for_camera = zones_store.get(label, [])
-
-        boxes = getattr(results, "boxes", None)
-        if boxes is not None and len(boxes) > 0:
-            xyxy = boxes.xyxy  # Nx4
-            cls = boxes.cls   # Nx1
-            conf = boxes.conf  # Nx1
-            ids = getattr(boxes, "id", None)  # Nx1 or None
-
-            n = len(boxes)
-            for i in range(n):
-                # class & confidence
-                try:
-                    cls_id = int(cls[i].item())
-                except Exception:
-                    cls_id = int(cls[i]) if hasattr(cls, "__getitem__") else -1
-                cls_name = model.names.get(cls_id, str(cls_id))
-
-                try:
-                    c = float(conf[i].item())
-                except Exception:
-                    c = float(conf[i]) if hasattr(conf, "__getitem__") else 0.0
-
-                # quality gates
-                if c < conf_threshold:
-                    continue
-
-                # bbox
-                x1, y1, x2, y2 = map(int, map(round, xyxy[i].tolist()))
-                w, h = max(0, x2 - x1), max(0, y2 - y1)
-                if w * h < min_box_area:
-                    continue
-
-                # --- ✅ Zone filtering (with fallback) ---
-                cx, cy = int((x1 + x2) / 2), int((y1 + y2) / 2)
-
-                if zones_for_camera:
-                    zone_id = None
-                    for zone in zones_for_camera:
-                        polygon = np.array(zone["points"], np.int32)
-                        if cv2.pointPolygonTest(polygon, (cx, cy), False) >= 0:
-                            zone_id = zone["id"]
-                            break
-                    if zone_id is None:
-                        continue  # skip detection outside all zones
-                else:
-                    zone_id = None
-
-                # bucket counts (first matching bucket wins)
-                for task, class_list in detection_classes.items():
-                    if cls_name in class_list:
-                        counts[task] += 1
-                        break
+        overlay = []
+        records = []  # this frame's events, sent as one message
+        date_s, time_s = _now_local_strs()
+        ts_ms = int(time.time() * 1000)
+
+        dets = _boxes_to_numpy(boxes)
+        if dets is not None and len(dets) > 0:
+            # Boxes.data is [x1, y1, x2, y2, (id,) conf, cls]
+            xyxy = np.rint(dets[:, :4]).astype(np.int64)
+            conf = dets[:, -2].astype(np.float64)
+            cls_ids = dets[:, -1].astype(np.int64)
+            ids = dets[:, 4].astype(np.int64) if dets.shape[1] == 7 else None  # present only when tracking
+
+            # quality gates
+            wh = np.clip(xyxy[:, 2:] - xyxy[:, :2], 0, None)
+            keep = (conf >= conf_threshold) & (wh[:, 0] * wh[:, 1] >= min_box_area)
+
+            # --- ✅ Zone filtering: every box center in one raster lookup (-1 = outside all zones) ---
+            zone_idx = None
+            if zone_index:
+                cx = ((xyxy[:, 0] + xyxy[:, 2]) / 2).astype(np.intp)
+                cy = ((xyxy[:, 1] + xyxy[:, 3]) / 2).astype(np.intp)
+                zone_idx = zone_index.lookup(cx, cy, frame.shape)
+                keep &= zone_idx >= 0
+
+            # bucket counts (first matching bucket wins)
+            if names is not lut_names:
+                bucket_lut, lut_names = _class_bucket_lut(names, detection_classes), names
+            known = (cls_ids >= 0) & (cls_ids < len(bucket_lut))
+            buckets = np.full(len(cls_ids), -1, dtype=np.int64)
+            buckets[known] = bucket_lut[cls_ids[known]]
+            counted = buckets[keep]
+            per_task = np.bincount(counted[counted >= 0], minlength=len(task_keys))
+            counts = {k: int(per_task[j]) for j, k in enumerate(task_keys)}
+
+            # only emitting overlay/events is left per box
+            for i in np.flatnonzero(keep):
+                x1, y1, x2, y2 = (int(v) for v in xyxy[i])
+                w, h = int(wh[i, 0]), int(wh[i, 1])
+                cls_id = int(cls_ids[i])
+                cls_name = names.get(cls_id, str(cls_id))
+                c = float(conf[i])
+                zone_id = zone_index.ids[zone_idx[i]] if zone_idx is not None else None
 
                 # draw overlay for MJPEG stream
                 color = colors.get(cls_name, (0, 255, 255))
+                text = f"{cls_name} {c:.2f}"
+                overlay.append((int(ids[i]) if ids is not None else None, color, text))
                 cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
                 cv2.putText(
                     frame,
-                    f"{cls_name} {c:.2f}",
+                    text,
                     (x1, max(10, y1 - 8)),
                     cv2.FONT_HERSHEY_SIMPLEX,
                     0.5,
@@ -190,42 +348,18 @@ def camera_worker(
                     cv2.LINE_AA,
                 )
 
-                # track id (present only when using tracker)
-                tid = None
-                if ids is not None:
-                    try:
-                        tid = int(ids[i].item())
-                    except Exception:
-                        try:
-                            tid = int(ids[i])
-                        except Exception:
-                            tid = None
-
-                if tid is None:
+                if ids is None:
                     # no id -> we still draw & count but don't emit events
                     continue
 
+                tid = int(ids[i])
                 active_ids.add(tid)
 
-                # base event
-                date_s, time_s = _now_local_strs()
-
-                base_evt = {
-                    "type": cls_name,
-                    "label": label,
-                    "zone_id": zone_id,
-                    "track_id": int(tid),
-                    "confidence": c,
-                    "bbox": [int(x1), int(y1), int(x2), int(y2)],
-                    "date": date_s,
-                    "time": time_s,
-                }
-
                 # appear once with thumbnail; then update w/o thumbnail
                 if tid not in seen_ids:
                     seen_ids.add(tid)
 
-                    thumb_b64 = None
+                    thumb = None
                     if w > 0 and h > 0:
                         crop = frame[max(0, y1):y1 + h, max(0, x1):x1 + w]
                         if crop.size > 0:
@@ -233,64 +367,97 @@ def camera_worker(
                                 crop = cv2.resize(crop, (thumbnail_side, thumbnail_side))
                                 ok_enc, buf = cv2.imencode(".webp", crop, [cv2.IMWRITE_WEBP_QUALITY, 70])
                                 if ok_enc:
-                                    thumb_b64 = base64.b64encode(buf).decode("utf-8")
+                                    thumb = buf.tobytes()
                             except Exception as enc_err:
                                 print(f"[WARNING] '{label}' thumbnail encode failed: {enc_err}")
 
-                    evt = {"event": "appear", **base_evt}
-                    if thumb_b64:
-                        evt["thumbnail"] = thumb_b64
-                        evt["mime"] = "image/webp"
-                    event_queue.put(evt)
+                    records.append((EV_APPEAR, tid, cls_name, zone_id, c, x1, y1, x2, y2, thumb))
                 else:
-                    event_queue.put({"event": "update", **base_evt})
+                    records.append((EV_UPDATE, tid, cls_name, zone_id, c, x1, y1, x2, y2))
 
         # schedule 'lost' for ids that vanished this frame (broadcaster grace-delays to 'disappear')
-        lost_ids = prev_active_ids - active_ids
-        if lost_ids:
-            date_s, time_s = _now_local_strs()
-            for tid in lost_ids:
-                event_queue.put({
-                    "event": "lost",
-                    "label": label,
-                    "track_id": int(tid),
-                    "date": date_s,
-                    "time": time_s,
-                })
+        for tid in prev_active_ids - active_ids:
+            records.append((EV_LOST, int(tid)))
+        # counts ride along only when they changed
+        changed_counts = counts if counts != last_counts else None
+        if records or changed_counts is not None:
+            event_queue.put((label, ts_ms, date_s, time_s, records, changed_counts))
+        last_counts = counts
 
         prev_active_ids = active_ids
+        if overlay:
+            last_activity = time.time()
 
-        # encode annotated frame for MJPEG
-        ok_jpg, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        if ok_jpg:
-            frame_store[label] = buffer.tobytes()
-            count_store[label] = counts
-            last_frame_time[label] = time.time()
+        _publish_frame()
 
-    cap.release()
+    capture.stop()
+    frame_ring.close()
+    if inference_channel is not None:
+        detector.close()
     print(f"[WORKER] Camera '{label}' stopped.")
 
 
 class CameraManager:
-    def __init__(self):
+    def __init__(
+        self,
+        inference_server=False,     # share batched inference workers instead of one model per camera
+        inference_workers=1,
+        inference_batch_size=8,
+        inference_max_latency=0.02,  # seconds to wait for more frames after the first one in a batch
+        max_cameras=32,
+        inference_budget_fps=None,  # total inferences/s spread across all cameras, e.g. 40.0 (None = every frame)
+        min_camera_fps=1.0,         # per-camera floor/ceiling once a budget is set
+        max_camera_fps=15.0,
+        motion_gate=False,          # skip YOLO on static frames (see camera_worker motion_* options)
+        roi_mode=False,             # infer only the bounding box of a camera's zones
+        log_updates=False,          # persist 'update' events too (batched writer makes this affordable)
+        retention=None,             # days per table, e.g. EXAMPLE_RETENTION; None keeps everything
+        prune_interval=600,         # seconds between retention passes
+        pdf_appendix_limit=2000,    # raw rows listed after the PDF summary; the rest is left to CSV/Parquet
+        export_cache_ttl=86400,     # seconds finished export jobs (and cached closed-range results) are kept
+        capture_backend="opencv",   # default decode backend per camera, see capture.CAPTURE_BACKENDS
+    ):
         logger.info("Initializing CameraManager...")
         manager = Manager()
-        self.frame_store = manager.dict()
-        self.last_frame_time = manager.dict()
-        self.count_store = manager.dict()
-        self.zones = manager.dict()
-
-        self.pending_disappears = manager.dict()
-        self.event_queue = manager.Queue()  # NEW: Event transport queue
+        self.frame_rings = {}  # label -> FrameRing (shared memory, owned here)
+        self.frame_hubs = {}  # label -> FrameHub (MJPEG viewer fanout)
+        # label -> per-task counts, fed by the workers' event messages (see _set_counts)
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+        self._counts_dirty = set()
+        self._counts_removed = set()
+        self._counts_seq = 0
+        self._counts_changed = threading.Event()
+        self.stats_store = manager.dict()  # label -> capture/processing stats pushed by workers
+        self.control_queues = {}  # label -> Queue of (cmd, value) messages for the worker
+        self.zones = {}  # label -> zones; pushed to the worker's control queue on change
+
+        self.pending_disappears = {}  # (label, track_id) -> deadline; only touched by the broadcaster and stop_camera
+        self._track_info = {}  # (label, track_id) -> (class, zone_id), so disappear events can be filtered too
+        self._coalescers = {}  # EventSubscription -> UpdateCoalescer (broadcaster thread only)
+        self.event_queue = Queue()  # per-frame event batches from the workers (see _decode_frame_events)
 
-        self.clients = set()  # ✅ NEW: WebSocket clients /ws/events clients
-        self.count_clients = set()  # /ws/counts clients
-        self.frontend_count_clients = set()  # NEW: /ws/counts-list clients
         self.loop = asyncio.get_event_loop()
+        # Each client gets a bounded send queue + sender task (see ws_fanout)
+        self.clients = ClientGroup(self.loop)  # /ws/events clients, keyed by EventSubscription
+        self.count_clients = ClientGroup(self.loop)  # /ws/counts clients, keyed by (wire format, delta)
+        self.frontend_count_clients = ClientGroup(self.loop)  # /ws/counts-list clients, keyed by (wire format, delta)
 
         # Event / tracker tuning
         self.disappear_grace_sec = 1.5
 
+        # Inference rate scheduling
+        self.inference_budget_fps = inference_budget_fps
+        self.min_camera_fps = min_camera_fps
+        self.max_camera_fps = max_camera_fps
+        self.activity_hold_sec = 10.0  # a camera stays "active" this long after its last detection
+        self.active_weight = 4.0  # share of the budget an active camera gets relative to an idle one
+        self._camera_rates = {}  # label -> last target fps sent to the worker
+
+        # Extra camera_worker keyword options applied to every camera
+        self.worker_options = {"motion_gate": motion_gate, "roi_mode": roi_mode}
+        self.capture_backend = capture_backend
+
         self.processes = {}
         self._running = True
 
@@ -299,6 +466,11 @@ class CameraManager:
             'vehicles': ['car', 'bus', 'truck', 'motorbike', 'bicycle'],
             'boxes': ['box', 'cardboard', 'carton']
         }
+        # class -> task bucket (first matching bucket wins), used for rollups
+        self.task_of_class = {}
+        for task, class_list in self.detection_classes.items():
+            for cls_name in class_list:
+                self.task_of_class.setdefault(cls_name, task)
 
         self.colors = {
             'person': (0, 255, 0),
@@ -313,110 +485,149 @@ class CameraManager:
         }
 
         # ----- DB Setup -----
+        # Reads go through self._db; all inserts go through the batched writer thread.
         self._db_lock = threading.Lock()
-        self._db = sqlite3.connect(DB_PATH, check_same_thread=False)
-        self._db.execute("""
-        CREATE TABLE IF NOT EXISTS detections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            label TEXT,
-            class TEXT,
-            track_id INTEGER,
-            confidence REAL,
-            x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
-            date TEXT, time TEXT,
-            event TEXT,      -- 'appear' | 'update' | 'disappear'
-            mime TEXT,
-            thumbnail_b64 TEXT
-            )
-        """)
-
-        # Helpful indexes for filtering
-        self._db.execute("CREATE INDEX IF NOT EXISTS idx_dt ON detections(date, time)")
-        self._db.execute("CREATE INDEX IF NOT EXISTS idx_label ON detections(label)")
-        self._db.execute("CREATE INDEX IF NOT EXISTS idx_class ON detections(class)")
-        self._db.commit()
+        self._db = open_db(DB_PATH)
+        init_schema(self._db, self.task_of_class)
+        self.log_updates = log_updates  # also persist 'update' events, not only 'appear'
+        self.db_writer = DetectionWriter(DB_PATH, self.task_of_class)
+        # Deletes expired rows in small batches on its own connection; never touches _db_lock
+        self.db_pruner = RetentionPruner(DB_PATH, retention, interval=prune_interval)
+        self.pdf_appendix_limit = pdf_appendix_limit
+        self.jobs = JobRunner(os.path.join(tempfile.gettempdir(), "yolo_witness_jobs"), keep_sec=export_cache_ttl)
+
+        # ----- Inference server (optional) -----
+        self.inference_server = inference_server
+        self.inference_procs = []
+        self.inference_inputs = {}  # label -> SharedMemory frame input buffer
+        self._camera_slots = {}  # label -> response pipe slot
+        if inference_server:
+            self._inference_requests = Queue()
+            pipes = [Pipe(duplex=False) for _ in range(max_cameras)]
+            self._response_recv = [r for r, _ in pipes]
+            response_send = [w for _, w in pipes]
+            self._free_slots = list(range(max_cameras))
+            for _ in range(max(1, inference_workers)):
+                p = Process(target=inference_server_worker, args=(
+                    self._inference_requests,
+                    response_send,
+                ), kwargs={
+                    "batch_size": inference_batch_size,
+                    "max_latency": inference_max_latency,
+                }, daemon=True)
+                p.start()
+                self.inference_procs.append(p)
+            logger.info(f"Inference server started with {len(self.inference_procs)} worker(s).")
 
         threading.Thread(target=self._event_broadcaster, daemon=True).start()
         threading.Thread(target=self._watchdog_loop, daemon=True).start()
         threading.Thread(target=self._counts_publisher, daemon=True).start()
+        threading.Thread(target=self._rate_scheduler_loop, daemon=True).start()
         logger.info("CameraManager threads started.")
 
     def is_running(self, label):
         return label in self.processes and self.processes[label].is_alive()
 
-    def add_client(self, ws):
-        self.clients.add(ws)
+    # add_*_client return the client's ClientChannel; the websocket handler awaits its run()
+    def add_client(self, ws, subscription=None):
+        return self.clients.add(ws, subscription or EventSubscription())
 
     def remove_client(self, ws):
-        self.clients.discard(ws)
+        self.clients.remove(ws)
 
-    def add_count_client(self, ws):
-        self.count_clients.add(ws)
+    def add_count_client(self, ws, fmt="json", delta=True):
+        channel = self.count_clients.add(ws, (fmt, bool(delta)))
+        channel.offer([(self._counts_keyframe("api", fmt, delta), False)])
+        return channel
 
     def remove_count_client(self, ws):
-        self.count_clients.discard(ws)
+        self.count_clients.remove(ws)
 
-    def add_frontend_count_client(self, ws):
-        self.frontend_count_clients.add(ws)
+    def add_frontend_count_client(self, ws, fmt="json", delta=False):
+        channel = self.frontend_count_clients.add(ws, (fmt, bool(delta)))
+        channel.offer([(self._counts_keyframe("frontend", fmt, delta), False)])
+        return channel
 
     def remove_frontend_count_client(self, ws):
-        self.frontend_count_clients.discard(ws)
-
-    def broadcast_event(self, event: dict):
-        try:
-            message = json.dumps(event, ensure_ascii=False)
-            asyncio.run_coroutine_threadsafe(
-                self._broadcast(message),
-                self.loop
-            )
-        except Exception as e:
-            print(f"[ERROR] Broadcasting event: {e}")
+        self.frontend_count_clients.remove(ws)
 
-    def broadcast_counts(self, payload: dict):
+    def broadcast_events(self, events):
+        """
+        Filter a batch of events for each distinct /ws/events subscription and queue
+        it for that subscription's clients. Each event is serialized at most once,
+        however many subscriptions and clients receive it. Broadcaster thread only.
+        """
+        if not events or not self.clients:
+            return
+        rendered = {}  # (id(event), wire format) -> encoded message
         try:
-            message = json.dumps(payload, ensure_ascii=False)
-            asyncio.run_coroutine_threadsafe(
-                self._broadcast_counts(message),
-                self.loop
-            )
+            for sub in self.clients.keys():
+                coalescer = self._coalescer_for(sub)
+                items = []
+                for e in events:
+                    if not sub.matches(e):
+                        continue
+                    evt_type = e.get("event")
+                    if coalescer is not None:
+                        if evt_type == "update":
+                            coalescer.add(e)
+                            continue
+                        if evt_type == "disappear":
+                            coalescer.forget(e["label"], e["track_id"])
+                    message = rendered.get((id(e), sub.format))
+                    if message is None:
+                        message = rendered[(id(e), sub.format)] = encode(e, sub.format)
+                    # appear/disappear survive queue overflow; updates are superseded by the next one anyway
+                    items.append((message, evt_type not in ("appear", "disappear")))
+                self.clients.publish_many(items, key=sub)
         except Exception as e:
-            print(f"[ERROR] Broadcasting counts: {e}")
-
-    async def _broadcast(self, message: str):
-        to_remove = set()
-        for ws in self.clients:
-            try:
-                await ws.send_text(message)
-            except Exception:
-                to_remove.add(ws)
-        self.clients -= to_remove
-
-    async def _broadcast_counts(self, message: str):
-        to_remove = set()
-        for ws in self.count_clients:
-            try:
-                await ws.send_text(message)
-            except Exception:
-                to_remove.add(ws)
-        self.count_clients -= to_remove
+            print(f"[ERROR] Broadcasting events: {e}")
+
+    def _coalescer_for(self, sub):
+        if not sub.coalesce_ms:
+            return None
+        coalescer = self._coalescers.get(sub)
+        if coalescer is None:
+            coalescer = self._coalescers[sub] = UpdateCoalescer(sub.coalesce_ms)
+        return coalescer
+
+    def _flush_coalesced(self, now):
+        """Send due coalesced update batches; returns seconds until the next one is due."""
+        live = set(self.clients.keys())
+        wait = 0.2
+        for sub, coalescer in list(self._coalescers.items()):
+            if sub not in live:
+                del self._coalescers[sub]
+                continue
+            batches = coalescer.flush(now)
+            if batches:
+                self.clients.publish_many([(encode(b, sub.format), True) for b in batches], key=sub)
+            wait = min(wait, max(0.0, coalescer.next_due - now))
+        return wait
+
+    def get_ws_stats(self):
+        return {
+            "events": self.clients.stats(),
+            "counts": self.count_clients.stats(),
+            "counts_list": self.frontend_count_clients.stats(),
+        }
 
-    async def _broadcast_frontend_counts(self, message: str):
-        to_remove = set()
-        for ws in self.frontend_count_clients:
-            try:
-                await ws.send_text(message)
-            except Exception:
-                to_remove.add(ws)
-        self.frontend_count_clients -= to_remove
+    def get_camera_stats(self):
+        """Latest capture/processing stats per running camera."""
+        return {label: dict(stats) for label, stats in list(self.stats_store.items())}
 
     def set_zones(self, label: str, zones: list[dict]):
-        """Replace all zones for a camera."""
+        """Replace all zones for a camera and push them to its worker."""
         self.zones[label] = zones
+        q = self.control_queues.get(label)
+        if q is not None:
+            q.put(("zones", zones))
 
     def get_zones(self, label:str):
         return self.zones.get(label, [])
 
-    def start_camera(self, ip_address, label):
+    def start_camera(self, ip_address, label, capture_options=None):
+        """`capture_options`: per-camera LatestFrameCapture overrides (backend, substream, keyframes_only, ...)."""
         if self.is_running(label):
             logger.warning(f"Camera '{label}' is already running.")
             print(f"[INFO] Camera '{label}' is already running.")
@@ -435,38 +646,113 @@ class CameraManager:
             print(f"[INFO] Starting camera process for '{label}' with stream: {ip_address}")
 
         print(f"[INFO] Starting camera process for '{label}' at {ip_address}")
+        self._release_frames(label)
+        ring = FrameRing.create()
+        frame_cond = Condition()
+        self.frame_rings[label] = ring
+        self.frame_hubs[label] = FrameHub(ring, frame_cond, wrap=self._mjpeg_part)
+
+        inference_channel = None
+        if self.inference_server:
+            inference_channel = self._acquire_inference_channel(label)
+            if inference_channel is None:
+                logger.error(f"No free inference slot for camera '{label}'.")
+                self._release_frames(label)
+                return
+
+        control_queue = Queue()
+        control_queue.put(("zones", self.get_zones(label)))
+        self.control_queues[label] = control_queue
+        self._camera_rates.pop(label, None)
+
         p = Process(target=camera_worker, args=(
             ip_address,
             label,
-            self.frame_store,
-            self.count_store,
+            ring.name,
+            frame_cond,
             self.detection_classes,
             self.colors,
-            self.last_frame_time,
             self.event_queue,
-            self.zones,
-        ), daemon=True)
+            self.stats_store,
+            control_queue,
+        ), kwargs={
+            **self.worker_options,
+            "inference_channel": inference_channel,
+            "capture_options": {"backend": self.capture_backend, **(capture_options or {})},
+        }, daemon=True)
         p.start()
         self.processes[label] = p
 
-    def generate_frames(self, label):
-        """
-        Safe MJPEG generator: tolerates camera stop/removal without throwing KeyError.
-        """
-        boundary = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
-        while True:
-            # If the process died or label was removed, end the generator
-            if label not in self.processes or not self.is_running(label):
-                # allow any remaining reader to exit cleanly
-                time.sleep(0.05)
-                break
+    def _acquire_inference_channel(self, label):
+        """Reserve a response pipe + shared-memory input buffer for one camera."""
+        self._release_inference_channel(label)
+        if not self._free_slots:
+            return None
+        slot = self._free_slots.pop(0)
+        shm = shared_memory.SharedMemory(create=True, size=MAX_FRAME_BYTES)
+        self._camera_slots[label] = slot
+        self.inference_inputs[label] = shm
+        # drop late answers addressed to the previous owner of this slot
+        conn = self._response_recv[slot]
+        while conn.poll():
+            conn.recv()
+        return self._inference_requests, conn, slot, shm.name
+
+    def _release_inference_channel(self, label):
+        slot = self._camera_slots.pop(label, None)
+        if slot is not None:
+            self._free_slots.append(slot)
+        shm = self.inference_inputs.pop(label, None)
+        if shm is not None:
+            shm.close()
             try:
-                frame_bytes = self.frame_store[label]
-            except KeyError:
-                time.sleep(0.05)
-                continue
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _mjpeg_part(frame_bytes):
+        return b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n"
+
+    def _release_frames(self, label):
+        hub = self.frame_hubs.pop(label, None)
+        if hub is not None:
+            hub.close()
+        ring = self.frame_rings.pop(label, None)
+        if ring is not None:
+            ring.unlink()
 
-            yield boundary + frame_bytes + b"\r\n"
+    async def generate_frames(self, label, max_fps=None):
+        """
+        Event-driven async MJPEG generator: yields a part only when the worker has
+        published a new frame, optionally capped at `max_fps` for this client.
+        Runs on the event loop, so viewers don't hold threadpool workers.
+        Tolerates camera stop/removal without throwing KeyError.
+        """
+        hub = self.frame_hubs.get(label)
+        if hub is None:
+            return
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+        last_seq = 0
+        next_due = 0.0
+        waiter = hub.add_viewer()
+        try:
+            while True:
+                # If the process died or label was removed, end the generator
+                if not self.is_running(label) or self.frame_hubs.get(label) is not hub:
+                    break
+                if min_interval:
+                    delay = next_due - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                seq, part = await hub.wait_frame(waiter, last_seq, timeout=1.0)
+                if part is None:
+                    continue
+                last_seq = seq
+                next_due = time.monotonic() + min_interval
+                yield part
+        finally:
+            hub.remove_viewer(waiter)
 
     def stop_camera(self, label, join_timeout=5):
         # kill process
@@ -474,6 +760,12 @@ class CameraManager:
         proc = self.processes.get(label)
         if proc and proc.is_alive():
             print(f"[INFO] Stopping camera '{label}'")
+            # ask first: killing a worker mid-put can leave the shared event queue's lock held
+            control_queue = self.control_queues.get(label)
+            if control_queue is not None:
+                control_queue.put(("stop", None))
+                proc.join(min(join_timeout, 3))
+        if proc and proc.is_alive():
             proc.terminate()
             proc.join(join_timeout)
             if proc.is_alive():
@@ -481,12 +773,18 @@ class CameraManager:
                 proc.kill()
                 proc.join()
         self.processes.pop(label, None)
-        self.frame_store.pop(label, None)
-        self.count_store.pop(label, None)
-        self.last_frame_time.pop(label, None)
+        self._release_frames(label)
+        self._release_inference_channel(label)
+        self._drop_counts(label)
+        self.stats_store.pop(label, None)
+        self.control_queues.pop(label, None)
+        self._camera_rates.pop(label, None)
         for k in list(self.pending_disappears.keys()):
             if k[0] == label:
                 self.pending_disappears.pop(k, None)
+        for k in list(self._track_info.keys()):
+            if k[0] == label:
+                self._track_info.pop(k, None)
         print(f"[INFO] Camera '{label}' stopped (cleanup done).")
 
     def stop_all(self, join_timeout=5):
@@ -494,10 +792,12 @@ class CameraManager:
         print(f"[INFO] Stopping all camera processes...")
         for label in list(self.processes.keys()):
             self.stop_camera(label, join_timeout)
-        self.frame_store.clear()
-        self.count_store.clear()
-        self.last_frame_time.clear()
+        for label in list(self.frame_rings.keys()):
+            self._release_frames(label)
+        self._drop_counts()
+        self.stats_store.clear()
         self.pending_disappears.clear()
+        self._track_info.clear()
         print("[INFO] All cameras stopped.")
 
     def shutdown(self):
@@ -505,6 +805,15 @@ class CameraManager:
         print(f"[INFO] Shutting down CameraManager...")
         self._running = False
         self.stop_all()
+        self.db_writer.close()
+        self.db_pruner.close()
+        self.jobs.close()
+        for _ in self.inference_procs:
+            self._inference_requests.put(None)
+        for p in self.inference_procs:
+            p.join(2)
+            if p.is_alive():
+                p.terminate()
         try:
             with self._db_lock:
                 self._db.close()
@@ -519,65 +828,161 @@ class CameraManager:
             for label in list(self.processes.keys()):
                 if not self.is_running(label):
                     continue
-                last_seen = self.last_frame_time.get(label, now)
+                ring = self.frame_rings.get(label)
+                last_seen = (ring.timestamp if ring is not None else 0.0) or now
                 if now - last_seen > timeout_sec:
                     print(f"[WATCHDOG] Camera '{label}' timed out. Stopping...")
                     self.stop_camera(label)
             time.sleep(5)
 
-    def _counts_publisher(self, interval=0.5):
-        """Push live per-camera counts + totals to /ws/counts clients."""
+    def _plan_rates(self, labels, stats, now):
+        """
+        Split the global inference budget across cameras: active cameras (recent
+        detections/tracks, or motion when the gate is on) weigh `active_weight`, idle ones 1, and every camera
+        is clamped to [min_camera_fps, max_camera_fps].
+        """
+        weights = {}
+        for label in labels:
+            st = stats.get(label) or {}
+            last_seen = max(st.get("last_activity", 0.0), st.get("last_motion") or 0.0)
+            active = st.get("active_tracks", 0) > 0 or now - last_seen < self.activity_hold_sec
+            weights[label] = self.active_weight if active else 1.0
+        total = sum(weights.values()) or 1.0
+        return {
+            label: round(min(self.max_camera_fps, max(self.min_camera_fps, self.inference_budget_fps * w / total)), 2)
+            for label, w in weights.items()
+        }
+
+    def _rate_scheduler_loop(self, interval=1.0):
+        """Periodically re-plan per-camera inference FPS and push changes to the workers."""
         while self._running:
-            snapshot = {}
-            totals = {}
-            ts_date, ts_time = _now_local_strs()
-            # collect
-            for label, counts in list(self.count_store.items()):
-                snapshot[label] = dict(counts)
-                for k, v in counts.items():
-                    totals[k] = totals.get(k, 0) + int(v)
-            # 1. API payload
-            api_payload = {"ts": {"date": ts_date, "time": ts_time}, "per_camera": snapshot, "totals": totals}
-            if self.count_clients:
-                try:
-                    message = json.dumps(api_payload, ensure_ascii=False)
-                    asyncio.run_coroutine_threadsafe(
-                        self._broadcast_counts(message), self.loop
-                    )
-                except Exception as e:
-                    print(f"[ERROR] Broadcasting API counts: {e}")
-
-            # 2. Frontend-friendly payload
-            per_camera_list = []
-            for cam, stats in snapshot.items():
-                cam_obj = {
-                    "camera": cam,
-                    # Use the frontend-friendly class names
-                    "box": stats.get("boxes", 0),
-                    "vehicle": stats.get("vehicles", 0),
-                    "people": stats.get("people", 0)
-                }
-                per_camera_list.append(cam_obj)
-
-            frontend_payload = {
+            time.sleep(interval)
+            if not self.inference_budget_fps:
+                continue
+            labels = [label for label in list(self.processes.keys()) if self.is_running(label)]
+            if not labels:
+                continue
+            try:
+                stats = dict(self.stats_store.items())
+            except Exception:
+                continue
+            for label, fps in self._plan_rates(labels, stats, time.time()).items():
+                if self._camera_rates.get(label) == fps:
+                    continue
+                q = self.control_queues.get(label)
+                if q is None:
+                    continue
+                q.put(("rate", fps))
+                self._camera_rates[label] = fps
+
+    def _set_counts(self, label, counts):
+        """Record a worker's new per-task counts (broadcaster thread) and wake the publisher."""
+        with self._counts_lock:
+            if label not in self.processes or self._counts.get(label) == counts:
+                return  # late message from a stopped camera, or nothing new
+            self._counts[label] = counts
+            self._counts_dirty.add(label)
+            self._counts_removed.discard(label)
+        self._counts_changed.set()
+
+    def _drop_counts(self, label=None):
+        """Forget one camera's counts (all with label=None) and publish the removal."""
+        with self._counts_lock:
+            labels = list(self._counts) if label is None else [label]
+            for name in labels:
+                if self._counts.pop(name, None) is not None:
+                    self._counts_removed.add(name)
+                self._counts_dirty.discard(name)
+        self._counts_changed.set()
+
+    @staticmethod
+    def _counts_payload(view, kind, seq, snapshot, changed=None, removed=()):
+        """
+        /ws/counts ("api") or /ws/counts-list ("frontend") message. kind "full" is the
+        original unversioned snapshot; "keyframe"/"delta" carry type + seq, and a delta
+        lists only the cameras that changed (and were removed) since the previous seq.
+        """
+        ts_date, ts_time = _now_local_strs()
+        totals = {}
+        for counts in snapshot.values():
+            for k, v in counts.items():
+                totals[k] = totals.get(k, 0) + int(v)
+        cameras = changed if kind == "delta" else snapshot
+
+        if view == "api":
+            payload = {"ts": {"date": ts_date, "time": ts_time}, "per_camera": cameras, "totals": totals}
+        else:
+            payload = {
                 "ts": {"date": ts_date, "time": ts_time},
+                # Use the frontend-friendly class names
                 "total": {
                     "box": totals.get("boxes", 0),
                     "vehicle": totals.get("vehicles", 0),
                     "people": totals.get("people", 0)
                 },
-                "per_camera": per_camera_list
+                "per_camera": [
+                    {
+                        "camera": cam,
+                        "box": stats.get("boxes", 0),
+                        "vehicle": stats.get("vehicles", 0),
+                        "people": stats.get("people", 0)
+                    }
+                    for cam, stats in cameras.items()
+                ],
             }
-
-            if self.frontend_count_clients:
-                try:
-                    message = json.dumps(frontend_payload, ensure_ascii=False)
-                    asyncio.run_coroutine_threadsafe(
-                        self._broadcast_frontend_counts(message), self.loop
-                    )
-                except Exception as e:
-                    print(f"[ERROR] Broadcasting frontend counts: {e}")
-            time.sleep(interval)
+        if kind != "full":
+            payload["type"] = kind
+            payload["seq"] = seq
+        if kind == "delta":
+            payload["removed"] = list(removed)
+        return payload
+
+    def _counts_keyframe(self, view, fmt, delta):
+        """Current counts for a client that just joined (unversioned for snapshot clients)."""
+        with self._counts_lock:
+            snapshot = {label: dict(c) for label, c in self._counts.items()}
+            seq = self._counts_seq
+        return encode(self._counts_payload(view, "keyframe" if delta else "full", seq, snapshot), fmt)
+
+    def _counts_publisher(self, min_interval=0.1, keyframe_interval=30.0):
+        """
+        Push per-camera counts to /ws/counts and /ws/counts-list clients when they change,
+        at most every `min_interval` seconds. Idle ticks send nothing but a keyframe every
+        `keyframe_interval` seconds; new clients get a keyframe when they join.
+        """
+        groups = ((self.count_clients, "api"), (self.frontend_count_clients, "frontend"))
+        next_keyframe = time.monotonic() + keyframe_interval
+        while self._running:
+            self._counts_changed.wait(timeout=max(0.0, next_keyframe - time.monotonic()))
+            now = time.monotonic()
+            keyframe = now >= next_keyframe
+            if keyframe:
+                next_keyframe = now + keyframe_interval
+            with self._counts_lock:
+                self._counts_changed.clear()
+                changed = {label: dict(self._counts[label]) for label in self._counts_dirty}
+                removed = sorted(self._counts_removed)
+                self._counts_dirty.clear()
+                self._counts_removed.clear()
+                if not (changed or removed or keyframe):
+                    continue
+                self._counts_seq += 1
+                seq = self._counts_seq
+                snapshot = {label: dict(c) for label, c in self._counts.items()}
+
+            # clients are keyed by (wire format, wants deltas)
+            kinds = {False: "full", True: "keyframe" if keyframe else "delta"}
+            for group, view in groups:
+                payloads = {}
+                for fmt, delta in group.keys():
+                    try:
+                        if delta not in payloads:
+                            payloads[delta] = self._counts_payload(view, kinds[delta], seq, snapshot, changed, removed)
+                        # a lost delta would leave the client wrong until the next keyframe
+                        group.publish_many([(encode(payloads[delta], fmt), not delta)], key=(fmt, delta))
+                    except Exception as e:
+                        print(f"[ERROR] Broadcasting {view} counts: {e}")
+            time.sleep(min_interval)
 
     def _event_broadcaster(self):
         """
@@ -589,109 +994,123 @@ class CameraManager:
         """
         print("[EVENT LOOP] Broadcaster started.")
         grace = float(self.disappear_grace_sec)
+        batch_limit = 256  # frame messages handled per wakeup
 
         while self._running or not self.event_queue.empty():
             now = time.time()
 
             # 1) Flush due disappears
+            due = [key for key, deadline in list(self.pending_disappears.items()) if now >= deadline]
+            if due:
+                date_s, time_s = _now_local_strs()
+                out = []
+                for key in due:
+                    if self.pending_disappears.pop(key, None) is None:
+                        continue
+                    label, tid = key
+                    cls_name, zone_id = self._track_info.pop(key, (None, None))
+                    out.append({
+                        "event": "disappear",
+                        "label": label,
+                        "track_id": int(tid),
+                        "type": cls_name,
+                        "zone_id": zone_id,
+                        "date": date_s,
+                        "time": time_s,
+                    })
+                self.broadcast_events(out)
+            wait = self._flush_coalesced(now)
+
+            # 2) Drain whatever the workers have queued, one message per camera frame
+            messages = []
             try:
-                for key, deadline in list(self.pending_disappears.items()):
-                    if now >= deadline:
-                        label, tid = key
-                        date_s, time_s = _now_local_strs()
-                        self.broadcast_event({
-                            "event": "disappear",
-                            "label": label,
-                            "track_id": int(tid),
-                            "date": date_s,
-                            "time": time_s,
-                        })
-                        self.pending_disappears.pop(key, None)
-            except RuntimeError:
-                # dict changed size during iteration; ignore and retry next tick
-                continue
-
-            # 2) Drain queue safely
-            try:
-                event = self.event_queue.get(timeout=0.2)
+                messages.append(self.event_queue.get(timeout=max(wait, 0.01)))
+                while len(messages) < batch_limit:
+                    messages.append(self.event_queue.get_nowait())
             except queue.Empty:
-                continue
+                pass
             except Exception as e:
                 print(f"[WARN] Event queue error: {e}")
                 continue
+            if not messages:
+                continue
 
-            try:
-                evt_type = event.get("event")
-                label = event.get("label")
-                tid = int(event.get("track_id", -1))
-
-                if evt_type == "lost":
-                    self.pending_disappears[(label, tid)] = now + grace
-                    continue
-
-                if evt_type in ("appear", "update"):
-                    self.pending_disappears.pop((label, tid), None)
+            out = []
+            now = time.time()
+            for message in messages:
+                try:
+                    if message[5] is not None:
+                        self._set_counts(message[0], message[5])
+                    for event in _decode_frame_events(message):
+                        evt_type = event["event"]
+                        key = (event["label"], event["track_id"])
+
+                        if evt_type == "lost":
+                            self.pending_disappears[key] = now + grace
+                            continue
+                        self.pending_disappears.pop(key, None)
+                        self._track_info[key] = (event.get("type"), event.get("zone_id"))
+                        out.append(event)
 
-                # Forward event
-                self.broadcast_event(event)
+                        # DB logging
+                        if evt_type == "appear" or (self.log_updates and evt_type == "update"):
+                            self._db_log(event)
+                except Exception as e:
+                    print(f"[WARN] Broadcasting event: {e}")
 
-                # DB logging
-                include_updates = False
-                if evt_type == "appear" or (include_updates and evt_type == "update"):
-                    self._db_log(event)
-
-            except Exception as e:
-                print(f"[WARN] Broadcasting event: {e}")
+            # Forward events
+            self.broadcast_events(out)
 
     # ---------------- DB helpers & exports -----------------
     def _db_log(self, event: dict):
-        """Insert one detection event into SQLite."""
-        try:
-            label = event.get("label", "")
-            cls = event.get("type", "")
-            track_id = int(event.get("track_id", -1))
-            conf = float(event.get("confidence", 0.0))
-            bbox = event.get("bbox") or [None, None, None, None]
-            x1, y1, x2, y2 = (int(b) if b is not None else None for b in bbox)
-            date = event.get("date", "")
-            time_s = event.get("time", "")
-            ev = event.get("event", "")
-            mime = event.get("mime", None)
-            thumb = event.get("thumbnail", None)
+        """Queue one detection event for the batched SQLite writer."""
+        self.db_writer.submit(event)
 
-            with self._db_lock:
-                self._db.execute(
-                    """INSERT INTO detections
-                                           (label, class, track_id, confidence, x1, y1, x2, y2, date, time,
-                                            event, mime, thumbnail_b64)
-                                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (label, cls, track_id, conf, x1, y1, x2, y2, date, time_s, ev, mime, thumb)
-                )
-                self._db.commit()
-        except Exception as e:
-            print(f"[DB] insert failed: {e}")
+    def get_db_stats(self):
+        stats = self.db_writer.stats()
+        stats["retention"] = self.db_pruner.stats()
+        return stats
 
-    def query_detections(self, start=None, end=None, label=None, cls=None):
-        """Return list[dict] of detections filtered by date range/label/class."""
+    def request_db_vacuum(self):
+        """Queue the one-off full VACUUM on the pruner thread; False if one is already pending."""
+        return self.db_pruner.request_vacuum()
+
+    @staticmethod
+    def _detections_filter(start=None, end=None, label=None, cls=None, zone_id=None, track_id=None):
+        """
+        WHERE clause + args for the common export filters.
+        `start`/`end` are local date/datetime strings (see to_epoch_ms); raises ValueError if unparsable.
+        """
         where = []
         args = []
-        if start:
-            where.append("(date || ' ' || time) >= ?")
-            args.append(start)
-        if end:
-            where.append("(date || ' ' || time) <= ?")
-            args.append(end)
+        start_ms = to_epoch_ms(start)
+        end_ms = to_epoch_ms(end, end_of_day=True)
+        if start_ms is not None:
+            where.append("ts >= ?")
+            args.append(start_ms)
+        if end_ms is not None:
+            where.append("ts <= ?")
+            args.append(end_ms)
         if label:
             where.append("label = ?")
             args.append(label)
         if cls:
             where.append("class = ?")
             args.append(cls)
+        if zone_id:
+            where.append("zone_id = ?")
+            args.append(str(zone_id))
+        if track_id is not None:
+            where.append("track_id = ?")
+            args.append(int(track_id))
+        return (" WHERE " + " AND ".join(where)) if where else "", args
+
+    def query_detections(self, start=None, end=None, label=None, cls=None):
+        """Return list[dict] of detections filtered by time range/label/class."""
+        where_sql, args = self._detections_filter(start, end, label, cls)
+        # thumbnails are served separately by get_thumbnail()
         sql = ("SELECT id, label, class, track_id, confidence, x1, y1, x2, y2, date,"
-               " time, event, mime, thumbnail_b64 FROM detections")
-        if where:
-            sql += " WHERE " + " AND ".join(where)
-        sql += " ORDER BY date, time"
+               " time, event, ts FROM detections" + where_sql + " ORDER BY ts, id")
 
         with self._db_lock:
             cur = self._db.execute(sql, args)
@@ -699,51 +1118,242 @@ class CameraManager:
             rows = [dict(zip(cols, r)) for r in cur.fetchall()]
         return rows
 
+    def iter_detections(self, columns, chunk_size=1000, progress=None, **filters):
+        """
+        Yield lists of row tuples (only `columns`) in (ts, id) order, `chunk_size` at a time.
+        Filters are validated before the first yield. Uses its own WAL read connection,
+        so a long export neither holds _db_lock nor blocks the writer.
+        `progress(fraction)`, if given, is called after each chunk.
+        """
+        where_sql, args = self._detections_filter(**filters)
+        sql = f"SELECT {', '.join(columns)} FROM detections{where_sql} ORDER BY ts, id"
+
+        def _rows():
+            conn = open_db(DB_PATH)
+            try:
+                total = done = 0
+                if progress:
+                    total = conn.execute(f"SELECT COUNT(*) FROM detections{where_sql}", args).fetchone()[0]
+                cur = conn.execute(sql, args)
+                while True:
+                    chunk = cur.fetchmany(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+                    done += len(chunk)
+                    if progress and total:
+                        progress(done / total)
+            finally:
+                conn.close()
+
+        return _rows()
+
+    @staticmethod
+    def _encode_cursor(ts, row_id):
+        raw = json.dumps([ts, row_id], separators=(",", ":")).encode("ascii")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            ts, row_id = json.loads(raw)
+            return int(ts), int(row_id)
+        except Exception:
+            raise ValueError("invalid cursor")
+
+    def page_detections(self, columns=None, limit=100, cursor=None, order="desc", count_only=False, **filters):
+        """
+        One page of detections using keyset pagination on (ts, id), so every page costs
+        the same however deep it is. Returns {"items", "next_cursor"} (next_cursor is None
+        on the last page) or {"count"} with `count_only`. Rows without a ts are skipped.
+        Raises ValueError on bad columns, cursor or filters.
+        """
+        where_sql, args = self._detections_filter(**filters)
+        where = [where_sql[len(" WHERE "):]] if where_sql else []
+        where.append("ts IS NOT NULL")
+
+        if count_only:
+            sql = "SELECT COUNT(*) FROM detections WHERE " + " AND ".join(where)
+            with self._db_lock:
+                return {"count": self._db.execute(sql, args).fetchone()[0]}
+
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        cols = list(columns or DETECTION_COLUMNS)
+        bad = [c for c in cols if c not in DETECTION_COLUMNS]
+        if bad:
+            raise ValueError(f"unknown column(s): {', '.join(bad)}")
+        cols = ["id", "ts"] + [c for c in cols if c not in ("id", "ts")]
+        limit = max(1, min(int(limit), 1000))
+
+        if cursor:
+            # row-value comparison lets SQLite seek straight into the (ts, rowid) index
+            where.append("(ts, id) > (?, ?)" if order == "asc" else "(ts, id) < (?, ?)")
+            args.extend(self._decode_cursor(cursor))
+        direction = "ASC" if order == "asc" else "DESC"
+        sql = (f"SELECT {', '.join(cols)} FROM detections WHERE {' AND '.join(where)}"
+               f" ORDER BY ts {direction}, id {direction} LIMIT ?")
+
+        with self._db_lock:
+            rows = self._db.execute(sql, (*args, limit + 1)).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        items = [dict(zip(cols, r)) for r in rows]
+        next_cursor = self._encode_cursor(rows[-1][1], rows[-1][0]) if more else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    def query_stats(self, granularity="hour", start=None, end=None, label=None, cls=None,
+                    task=None, zone_id=None, group_by=()):
+        """
+        Appear counts per time bucket from the rollup tables, optionally split by
+        any of label/class/task/zone_id. Raises ValueError on bad arguments.
+        """
+        table = ROLLUP_TABLES.get(granularity)
+        if table is None:
+            raise ValueError(f"granularity must be one of {', '.join(ROLLUP_TABLES)}")
+        group_cols = [c for c in group_by if c]
+        bad = set(group_cols) - {"label", "class", "task", "zone_id"}
+        if bad:
+            raise ValueError(f"cannot group by {', '.join(sorted(bad))}")
+
+        where = []
+        args = []
+        start_ms = to_epoch_ms(start)
+        end_ms = to_epoch_ms(end, end_of_day=True)
+        if start_ms is not None:
+            where.append("bucket >= ?")
+            args.append(start_ms)
+        if end_ms is not None:
+            where.append("bucket <= ?")
+            args.append(end_ms)
+        for col, val in (("label", label), ("class", cls), ("task", task), ("zone_id", zone_id)):
+            if val:
+                where.append(f"{col} = ?")
+                args.append(val)
+
+        cols = ", ".join(["bucket"] + group_cols)
+        sql = f"SELECT {cols}, SUM(count) FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" GROUP BY {cols} ORDER BY {cols}"
+
+        with self._db_lock:
+            rows = self._db.execute(sql, args).fetchall()
+        out = []
+        for row in rows:
+            item = {"bucket": row[0], "start": datetime.fromtimestamp(row[0] / 1000).astimezone().isoformat()}
+            item.update(zip(group_cols, row[1:-1]))
+            item["count"] = row[-1]
+            out.append(item)
+        return out
+
+    def get_thumbnail(self, detection_id: int):
+        """Return (mime, bytes) for a detection's thumbnail, or None."""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT mime, data FROM detection_thumbnails WHERE detection_id = ?",
+                (int(detection_id),),
+            ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        return row[0] or "image/webp", bytes(row[1])
+
+    def export_csv_stream(self, gzip=False, progress=None, **filters):
+        """
+        Iterator of CSV byte chunks (optionally one gzip stream), fed from the DB cursor
+        chunk by chunk. Raises ValueError up front for bad filters.
+        """
+        chunks = self.iter_detections(CSV_COLUMNS, progress=progress, **filters)
+
+        def _encode():
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(CSV_COLUMNS)
+            for rows in chunks:
+                writer.writerows(rows)
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+            tail = buf.getvalue()
+            if tail:
+                yield tail.encode("utf-8")
+
+        if not gzip:
+            return _encode()
+
+        def _gzip():
+            z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+            for part in _encode():
+                out = z.compress(part)
+                if out:
+                    yield out
+            yield z.flush()
+
+        return _gzip()
+
+    def export_columnar_stream(self, fmt="parquet", progress=None, **filters):
+        """
+        Iterator of Parquet or Arrow IPC stream bytes with typed columns and
+        dictionary-encoded label/class/event. Raises RuntimeError if pyarrow is missing.
+        """
+        chunks = self.iter_detections([name for name, _ in ARROW_COLUMNS], chunk_size=65536, progress=progress,
+                                      **filters)
+        return stream_columnar(chunks, fmt)
+
     def export_csv_text(self, **filters):
-        rows = self.query_detections(**filters)
-        buf = io.StringIO()
-        writer = csv.writer(buf)
-        writer.writerow(
-            ["id", "label", "class", "track_id", "confidence", "x1", "y1", "x2", "y2", "date", "time", "event"])
-        for r in rows:
-            writer.writerow([
-                r["id"], r["label"], r["class"], r["track_id"], r["confidence"],
-                r["x1"], r["y1"], r["x2"], r["y2"], r["date"], r["time"], r["event"]
-            ])
-        return buf.getvalue()
+        return b"".join(self.export_csv_stream(**filters)).decode("utf-8")
 
-    def export_pdf_bytes(self, **filters):
-        """Create a very simple PDF table using reportlab if installed."""
+    def _write_pdf_report(self, out, where_sql, args, progress=None):
+        conn = open_db(DB_PATH)  # own read connection, like iter_detections
         try:
-            from reportlab.lib.pagesizes import A4
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.units import cm
-        except Exception as e:
-            raise RuntimeError("reportlab not installed") from e
+            build_pdf_report(out, conn, where_sql, args, appendix_limit=self.pdf_appendix_limit, progress=progress)
+        finally:
+            conn.close()
 
-        rows = self.query_detections(**filters)
+    def export_pdf_bytes(self, **filters):
+        """Render the detections report in-process (see reports.build_pdf_report)."""
+        where_sql, args = self._detections_filter(**filters)
         packet = io.BytesIO()
-        c = canvas.Canvas(packet, pagesize=A4)
-        width, height = A4
-
-        title = "Detections Report"
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(2 * cm, height - 2 * cm, title)
-
-        c.setFont("Helvetica", 9)
-        y = height - 3 * cm
-        headers = ["date", "time", "label", "class", "track_id", "confidence"]
-        c.drawString(2 * cm, y, " | ".join(h.upper() for h in headers))
-        y -= 0.6 * cm
-
-        for r in rows:
-            line = f"{r['date']} | {r['time']} | {r['label']} | {r['class']} | {r['track_id']} | {r['confidence']:.2f}"
-            c.drawString(2 * cm, y, line[:120])
-            y -= 0.55 * cm
-            if y < 2 * cm:
-                c.showPage()
-                y = height - 2.5 * cm
-
-        c.showPage()
-        c.save()
+        self._write_pdf_report(packet, where_sql, args)
         return packet.getvalue()
+
+    def start_export_job(self, fmt, gzip=False, **filters):
+        """
+        Queue an export ("csv", "parquet", "arrow" or "pdf") as a background job and return its id.
+        Closed ranges (an `end` in the past) are cached on disk by their parameters, so asking
+        for the same report again returns the finished job. Raises ValueError for bad
+        format/filters and RuntimeError for a missing optional dependency, before queuing.
+        """
+        if fmt not in EXPORT_FILES:
+            raise ValueError(f"unknown export format '{fmt}'")
+        where_sql, args = self._detections_filter(**filters)
+        if fmt == "pdf":
+            require_reportlab()
+        elif fmt in ("parquet", "arrow"):
+            self.export_columnar_stream(fmt, **filters)  # checks pyarrow; the cursor opens lazily
+        filename, media_type = EXPORT_FILES[fmt]
+        if fmt == "csv" and gzip:
+            filename, media_type = filename + ".gz", "application/gzip"
+
+        def build(path, progress):
+            if fmt == "pdf":
+                self._write_pdf_report(path, where_sql, args, progress=progress)
+                return
+            if fmt == "csv":
+                chunks = self.export_csv_stream(gzip=gzip, progress=progress, **filters)
+            else:
+                chunks = self.export_columnar_stream(fmt, progress=progress, **filters)
+            with open(path, "wb") as f:
+                for part in chunks:
+                    f.write(part)
+
+        key = None
+        end_ms = to_epoch_ms(filters.get("end"), end_of_day=True)
+        if end_ms is not None and end_ms < time.time() * 1000:
+            params = {k: v for k, v in filters.items() if v is not None}
+            params.update(fmt=fmt, gzip=bool(gzip))
+            if fmt == "pdf":
+                params["appendix_limit"] = self.pdf_appendix_limit
+            key = json.dumps(params, sort_keys=True)
+        return self.jobs.submit(fmt, build, filename, media_type, key=key)
@@ -0,0 +1,384 @@
+import subprocess
+import threading
+import shutil
+import json
+import time
+import re
+import numpy as np
+import cv2
+import os
+
+try:
+    import psutil  # decoder CPU time for the FFmpeg backend (falls back to /proc on Linux)
+except Exception:
+    psutil = None
+
+CAPTURE_BACKENDS = ("opencv", "ffmpeg")
+
+# Main stream URL -> low-resolution substream URL, for common NVR/IP camera layouts
+_SUBSTREAM_PATTERNS = [
+    (re.compile(r"(/Streaming/Channels/\d+?)01\b", re.I), r"\g<1>02"),  # Hikvision
+    (re.compile(r"\bsubtype=0\b", re.I), "subtype=1"),  # Dahua / Amcrest
+    (re.compile(r"_main\b", re.I), "_sub"),  # Reolink (h264Preview_01_main)
+    (re.compile(r"/stream1\b", re.I), "/stream2"),  # TP-Link Tapo
+]
+
+
+def substream_url(url):
+    """The low-resolution substream URL for a known main-stream URL layout, or None."""
+    if not isinstance(url, str) or not url.lower().startswith("rtsp://"):
+        return None
+    for pattern, repl in _SUBSTREAM_PATTERNS:
+        sub, n = pattern.subn(repl, url, count=1)
+        if n:
+            return sub
+    return None
+
+
+def resolve_source(source, substream=None):
+    """
+    Pick what to decode: `substream` may be an explicit URL, "auto" (derive it with
+    substream_url(), falling back to the main stream) or None (main stream).
+    """
+    if not substream:
+        return source
+    if substream == "auto":
+        return substream_url(source) or source
+    return substream
+
+
+def _scaled_size(width, height, target_width):
+    """Output size after downscaling to `target_width` (aspect kept, even height for FFmpeg's scaler)."""
+    if width <= target_width:
+        return width, height
+    return target_width, max(2, int(round(height * target_width / width / 2.0)) * 2)
+
+
+class OpenCVBackend:
+    """cv2.VideoCapture + INTER_AREA downscale after decoding (works for webcams, files and streams)."""
+
+    name = "opencv"
+    paced = False  # files are paced by LatestFrameCapture
+
+    def __init__(self, source, target_width=640, hwaccel=None, threads=None, keyframes_only=False):
+        self.source = source
+        self.target_width = target_width
+        self.hwaccel = hwaccel
+        self.threads = threads
+        self._cap = None
+        self._cpu = 0.0  # capture-thread CPU seconds spent in read()
+        if keyframes_only:
+            print("[CAPTURE] keyframes_only needs the ffmpeg backend; decoding every frame.")
+
+    def open(self):
+        if self.threads:
+            # read by OpenCV's FFmpeg backend when the capture is opened (this is the camera's own process)
+            os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = f"threads;{int(self.threads)}"
+        params = []
+        if self.hwaccel and hasattr(cv2, "CAP_PROP_HW_ACCELERATION") and not isinstance(self.source, int):
+            params = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        if params:
+            self._cap = cv2.VideoCapture(self.source, cv2.CAP_FFMPEG, params)
+        else:
+            self._cap = cv2.VideoCapture(self.source)
+        # Smaller buffer for live streams helps keep latency low
+        try:
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        except Exception:
+            pass
+        return self._cap.isOpened()
+
+    def fps(self):
+        return self._cap.get(cv2.CAP_PROP_FPS) or 0.0
+
+    def read(self):
+        # thread CPU time, so waiting on the network/camera for the next frame isn't counted
+        t0 = time.thread_time()
+        try:
+            ok_read, frame = self._cap.read()
+            if not ok_read:
+                return None
+            # Downscale the frame to a manageable size immediately to prevent MemoryError
+            if frame.shape[1] > self.target_width:
+                aspect_ratio = frame.shape[1] / frame.shape[0]
+                target_height = int(self.target_width / aspect_ratio)
+                frame = cv2.resize(frame, (self.target_width, target_height), interpolation=cv2.INTER_AREA)
+            return frame
+        finally:
+            self._cpu += time.thread_time() - t0
+
+    def rewind(self):
+        return self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def cpu_seconds(self):
+        """CPU seconds spent decoding so far (read() runs on the capture thread only)."""
+        return self._cpu
+
+    def release(self):
+        if self._cap is not None:
+            self._cap.release()
+
+
+class FFmpegBackend:
+    """
+    An `ffmpeg` subprocess decoding to raw BGR frames on a pipe. Scaling happens
+    inside FFmpeg's filter graph, decoding can use `-threads` and `-hwaccel`, and
+    `keyframes_only` makes the decoder skip everything but keyframes
+    (`-skip_frame nokey`), which is far cheaper for low-FPS analysis.
+    """
+
+    name = "ffmpeg"
+    paced = True  # files are read with -re
+
+    def __init__(self, source, target_width=640, hwaccel=None, threads=None, keyframes_only=False):
+        self.source = source
+        self.target_width = target_width
+        self.hwaccel = hwaccel
+        self.threads = threads
+        self.keyframes_only = keyframes_only
+        self.binary = os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg")
+        self._proc = None
+        self._ps = None  # psutil.Process of self._proc
+        self._cpu_base = 0.0  # CPU seconds of ffmpeg processes already released (rewinds)
+        self._shape = None
+        self._fps = 0.0
+
+    @classmethod
+    def available(cls, source):
+        return not isinstance(source, int) and bool(os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg"))
+
+    def _is_rtsp(self):
+        return isinstance(self.source, str) and self.source.lower().startswith("rtsp://")
+
+    def _probe(self):
+        """(width, height, fps) of the first video stream, via ffprobe or else OpenCV."""
+        ffprobe = shutil.which("ffprobe")
+        if ffprobe:
+            cmd = [ffprobe, "-v", "error", "-select_streams", "v:0",
+                   "-show_entries", "stream=width,height,avg_frame_rate", "-of", "json"]
+            if self._is_rtsp():
+                cmd += ["-rtsp_transport", "tcp"]
+            try:
+                out = subprocess.run(cmd + [self.source], capture_output=True, timeout=15, check=True).stdout
+                stream = json.loads(out)["streams"][0]
+                num, _, den = stream.get("avg_frame_rate", "0/1").partition("/")
+                fps = float(num) / float(den or 1) if float(den or 1) else 0.0
+                return int(stream["width"]), int(stream["height"]), fps
+            except Exception as e:
+                print(f"[CAPTURE] ffprobe failed for {self.source}: {e}")
+        cap = cv2.VideoCapture(self.source)
+        try:
+            if not cap.isOpened():
+                return None
+            w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            return (w, h, cap.get(cv2.CAP_PROP_FPS) or 0.0) if w and h else None
+        finally:
+            cap.release()
+
+    def open(self):
+        if not self.binary:
+            return False
+        info = self._probe()
+        if info is None:
+            return False
+        width, height, self._fps = info
+        out_w, out_h = _scaled_size(width, height, self.target_width)
+        self._shape = (out_h, out_w, 3)
+
+        cmd = [self.binary, "-hide_banner", "-loglevel", "error", "-nostdin"]
+        if self.hwaccel:
+            cmd += ["-hwaccel", self.hwaccel]
+        if self.threads:
+            cmd += ["-threads", str(int(self.threads))]
+        if self.keyframes_only:
+            cmd += ["-skip_frame", "nokey"]
+        if self._is_rtsp():
+            cmd += ["-rtsp_transport", "tcp"]
+        elif os.path.isfile(str(self.source)):
+            cmd += ["-re", "-stream_loop", "-1"]
+        cmd += ["-i", str(self.source), "-an", "-sn"]
+        if (out_w, out_h) != (width, height):
+            cmd += ["-vf", f"scale={out_w}:{out_h}:flags=area"]
+        cmd += ["-vsync", "passthrough", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+        frame_bytes = out_w * out_h * 3
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                      stdin=subprocess.DEVNULL, bufsize=frame_bytes)
+        return True
+
+    def fps(self):
+        return self._fps
+
+    def read(self):
+        buf = bytearray(self._shape[0] * self._shape[1] * 3)
+        view = memoryview(buf)
+        pos = 0
+        while pos < len(buf):
+            n = self._proc.stdout.readinto(view[pos:])
+            if not n:
+                return None  # stream ended or ffmpeg exited
+            pos += n
+        return np.frombuffer(buf, dtype=np.uint8).reshape(self._shape)
+
+    def rewind(self):
+        self.release()
+        return self.open()
+
+    def _proc_cpu(self):
+        """CPU seconds (user + system) of the running ffmpeg process, or None."""
+        proc = self._proc
+        if proc is None:
+            return None
+        try:
+            if psutil is not None:
+                if self._ps is None or self._ps.pid != proc.pid:
+                    self._ps = psutil.Process(proc.pid)
+                t = self._ps.cpu_times()
+                return t.user + t.system
+            with open(f"/proc/{proc.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except Exception:
+            return None
+
+    def cpu_seconds(self):
+        """CPU seconds the ffmpeg process(es) spent decoding and scaling so far, or None."""
+        cpu = self._proc_cpu()
+        return None if cpu is None else self._cpu_base + cpu
+
+    def release(self):
+        self._cpu_base += self._proc_cpu() or 0.0
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        proc.kill()
+        try:
+            proc.stdout.close()
+            proc.wait(timeout=2)
+        except Exception:
+            pass
+
+
+class LatestFrameCapture:
+    """
+    Dedicated capture thread for one camera with a single-slot, latest-frame-wins handoff.
+
+    The thread decodes continuously and overwrites the slot with the newest
+    frame (already downscaled to `target_width`) and its capture timestamp,
+    so a slow consumer always picks up the freshest frame instead of working
+    through a backlog in the RTSP buffer. Frames that get overwritten before
+    anyone reads them are counted as dropped.
+
+    Decoding goes through a backend ("opencv" or "ffmpeg", see CAPTURE_BACKENDS);
+    `substream` selects a camera's low-resolution stream (see resolve_source).
+    """
+
+    def __init__(self, source, label, target_width=640, backend="opencv", substream=None,
+                 keyframes_only=False, hwaccel=None, decode_threads=None):
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)  # treat "0" or "1" as webcam index
+        self.source = resolve_source(source, substream)
+        self.label = label
+        self.target_width = target_width
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+
+        if backend == "ffmpeg" and not FFmpegBackend.available(self.source):
+            print(f"[WORKER] Camera '{label}': ffmpeg backend unavailable for this source, using OpenCV.")
+            backend = "opencv"
+        backend_cls = FFmpegBackend if backend == "ffmpeg" else OpenCVBackend
+        self._backend = backend_cls(self.source, target_width, hwaccel=hwaccel, threads=decode_threads,
+                                    keyframes_only=keyframes_only)
+
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._frame = None
+        self._frame_ts = 0.0
+        self._consumed_seq = 0
+        self._stopped = False
+        self.ended = False
+
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+        self.decode_ms = None  # moving average of decode+scale CPU time per frame (None if unknown)
+
+    def start(self):
+        """Open the source and start the capture thread. Returns False if the source can't be opened."""
+        if not self._backend.open():
+            self.ended = True
+            return False
+        threading.Thread(target=self._run, daemon=True).start()
+        return True
+
+    def _run(self):
+        backend = self._backend
+        # Video files are paced at their native rate instead of being decoded as fast as possible
+        file_interval = 0.0
+        if self.is_file and not backend.paced:
+            fps = backend.fps()
+            file_interval = 1.0 / fps if 0 < fps < 240 else 1.0 / 25
+        next_due = time.monotonic()
+        last_cpu = backend.cpu_seconds()
+
+        while not self._stopped:
+            frame = backend.read()
+            if frame is None:
+                if self.is_file and backend.rewind():
+                    continue
+                print(f"[WORKER] Camera '{self.label}': Frame read failed or end of stream.")
+                break
+            captured_at = time.time()
+            cpu = backend.cpu_seconds()
+            frame_ms = None
+            if cpu is not None and last_cpu is not None and cpu >= last_cpu:
+                frame_ms = (cpu - last_cpu) * 1000
+            last_cpu = cpu
+
+            with self._cond:
+                if self._seq and self._consumed_seq != self._seq:
+                    self.dropped += 1
+                self._seq += 1
+                self._frame = frame
+                self._frame_ts = captured_at
+                self.captured += 1
+                if frame_ms is not None:
+                    self.decode_ms = frame_ms if self.decode_ms is None else 0.9 * self.decode_ms + 0.1 * frame_ms
+                self._cond.notify_all()
+
+            if file_interval:
+                next_due += file_interval
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_due = time.monotonic()
+
+        backend.release()
+        with self._cond:
+            self.ended = True
+            self._cond.notify_all()
+
+    def read(self, after_seq=0, timeout=1.0):
+        """
+        Wait for a frame newer than `after_seq` and take it.
+        Returns (seq, captured_at, frame), or None on timeout / end of stream.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.ended or self._seq > after_seq, timeout)
+            if self._seq <= after_seq or self._frame is None:
+                return None
+            self._consumed_seq = self._seq
+            self.processed += 1
+            return self._seq, self._frame_ts, self._frame
+
+    def stats(self):
+        with self._cond:
+            return {
+                "captured": self.captured,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "backend": self._backend.name,
+                "decode_ms": None if self.decode_ms is None else round(self.decode_ms, 2),
+            }
+
+    def stop(self):
+        self._stopped = True
@@ -0,0 +1,109 @@
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except Exception as e:
+        raise RuntimeError("pyarrow not installed") from e
+    return pa, pq
+
+
+# (column, arrow type name) in export order; "dict" = dictionary-encoded string
+ARROW_COLUMNS = [
+    ("id", "int64"),
+    ("ts", "timestamp"),
+    ("label", "dict"),
+    ("class", "dict"),
+    ("event", "dict"),
+    ("track_id", "int64"),
+    ("confidence", "float32"),
+    ("x1", "int32"), ("y1", "int32"), ("x2", "int32"), ("y2", "int32"),
+]
+
+
+def _arrow_schema(pa):
+    types = {
+        "int64": pa.int64(),
+        "int32": pa.int32(),
+        "float32": pa.float32(),
+        "timestamp": pa.timestamp("ms", tz="UTC"),
+        "dict": pa.dictionary(pa.int32(), pa.string()),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in ARROW_COLUMNS])
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def drain(self):
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+def _record_batch(pa, schema, rows):
+    cols = list(zip(*rows))
+    arrays = []
+    for (name, kind), values, field in zip(ARROW_COLUMNS, cols, schema):
+        if kind == "dict":
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def stream_columnar(chunks, fmt="parquet"):
+    """
+    Turn an iterator of row-tuple chunks (columns in ARROW_COLUMNS order) into
+    an iterator of Parquet (one row group per chunk) or Arrow IPC stream bytes.
+    Raises RuntimeError up front when pyarrow is missing.
+    """
+    pa, pq = _require_pyarrow()
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"unknown columnar format '{fmt}'")
+    schema = _arrow_schema(pa)
+
+    def _gen():
+        sink = _ChunkSink()
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        try:
+            for rows in chunks:
+                writer.write_batch(_record_batch(pa, schema, rows))
+                data = sink.drain()
+                if data:
+                    yield data
+        finally:
+            writer.close()
+        data = sink.drain()
+        if data:
+            yield data
+
+    return _gen()
@@ -0,0 +1,641 @@
+from datetime import datetime, time as dtime
+from collections import Counter
+import threading
+import sqlite3
+import base64
+import queue
+import time
+
+
+def open_db(path):
+    """SQLite connection tuned for one writer + concurrent readers (WAL)."""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable across application crashes in WAL mode; only an OS crash can lose the last commits
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+ROLLUP_TABLES = {"minute": "rollup_minute", "hour": "rollup_hour", "day": "rollup_day"}
+
+# Days to keep per table; None keeps forever. Nothing is deleted unless asked for via RetentionPruner(retention=...)
+DEFAULT_RETENTION = {
+    "thumbnails": None,
+    "detections": None,
+    "rollup_minute": None,
+    "rollup_hour": None,
+    "rollup_day": None,
+}
+
+# A reasonable setup for long-running installs, e.g. CameraManager(retention=EXAMPLE_RETENTION)
+EXAMPLE_RETENTION = {
+    "thumbnails": 7,
+    "detections": 90,
+    "rollup_minute": 30,
+    "rollup_hour": 400,
+    "rollup_day": None,
+}
+
+
+def init_schema(conn, task_of_class=None):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS detections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        label TEXT,
+        class TEXT,
+        track_id INTEGER,
+        confidence REAL,
+        x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+        date TEXT, time TEXT,
+        event TEXT,      -- 'appear' | 'update' | 'disappear'
+        mime TEXT,
+        thumbnail_b64 TEXT,
+        ts INTEGER,      -- epoch milliseconds; what range filters and ordering use
+        zone_id TEXT     -- zone the box centre fell in (zone-filtered cameras only)
+        )
+    """)
+
+    # Thumbnails live outside the hot table so scans/exports never read them
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS detection_thumbnails (
+        detection_id INTEGER PRIMARY KEY,   -- detections.id
+        mime TEXT,
+        data BLOB
+        )
+    """)
+
+    # Pre-aggregated appear counts per local time bucket (bucket = epoch ms of its start)
+    for table in ROLLUP_TABLES.values():
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket INTEGER,
+            label TEXT,
+            class TEXT,
+            task TEXT,
+            zone_id TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, label, class, task, zone_id)
+            ) WITHOUT ROWID
+        """)
+    conn.commit()
+    migrate(conn, task_of_class or {})
+
+    # Range filters are always on ts, optionally with an equality on label or class first
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ts ON detections(ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_label_ts ON detections(label, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_class_ts ON detections(class, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_zone_ts ON detections(zone_id, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_track_ts ON detections(track_id, ts)")
+    conn.commit()
+
+
+def _migrate_thumbnails_to_blobs(conn, task_of_class, chunk=1000):
+    """v1: move base64 thumbnail_b64 values into detection_thumbnails as raw bytes."""
+    last_id = 0
+    while True:
+        # keyset on id so each chunk starts where the last one ended instead of rescanning nulled rows
+        rows = conn.execute(
+            """SELECT id, mime, thumbnail_b64 FROM detections
+               WHERE id > ? AND thumbnail_b64 IS NOT NULL ORDER BY id LIMIT ?""",
+            (last_id, chunk),
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        blobs = []
+        for det_id, mime, b64 in rows:
+            try:
+                blobs.append((det_id, mime, base64.b64decode(b64)))
+            except Exception:
+                pass  # unreadable legacy thumbnail: drop it
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO detection_thumbnails (detection_id, mime, data) VALUES (?, ?, ?)",
+                blobs,
+            )
+            conn.executemany(
+                "UPDATE detections SET thumbnail_b64 = NULL WHERE id = ?",
+                [(r[0],) for r in rows],
+            )
+
+
+def _migrate_add_ts(conn, task_of_class, chunk=20000):
+    """v2: add the epoch-ms ts column, backfill it from local date/time, drop the old text indexes."""
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(detections)")]
+    if "ts" not in cols:
+        conn.execute("ALTER TABLE detections ADD COLUMN ts INTEGER")
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM detections").fetchone()[0]
+    for lo in range(0, max_id, chunk):
+        with conn:
+            # 'utc' modifier: date/time were written in local time
+            conn.execute(
+                """UPDATE detections
+                   SET ts = CAST(strftime('%s', date || ' ' || time, 'utc') AS INTEGER) * 1000
+                   WHERE id > ? AND id <= ? AND ts IS NULL""",
+                (lo, lo + chunk),
+            )
+    conn.execute("DROP INDEX IF EXISTS idx_dt")
+    conn.execute("DROP INDEX IF EXISTS idx_label")
+    conn.execute("DROP INDEX IF EXISTS idx_class")
+
+
+def _migrate_backfill_rollups(conn, task_of_class, chunk=50000):
+    """v3: build the rollup tables from the appear events already on disk."""
+    for table in ROLLUP_TABLES.values():
+        conn.execute(f"DELETE FROM {table}")
+    cur = conn.execute("SELECT ts, label, class FROM detections WHERE event = 'appear' AND ts IS NOT NULL")
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            break
+        counts = rollup_counts(((ts, label, cls, None) for ts, label, cls in rows), task_of_class)
+        with conn:
+            upsert_rollups(conn, counts)
+
+
+def _migrate_incremental_vacuum(conn, task_of_class):
+    """
+    v4: ask for auto_vacuum=INCREMENTAL so the pruner can hand pages back to the OS.
+    On an existing file this only takes effect after a full VACUUM, which can take
+    minutes and twice the file size on disk, so it is left to vacuum_db() rather
+    than run at startup. A new, still empty database is converted right away.
+    """
+    if conn.execute("SELECT 1 FROM detections LIMIT 1").fetchone() is None:
+        vacuum_db(conn)
+    else:
+        print("[DB] Existing detections.db keeps auto_vacuum=NONE until a full VACUUM (POST /api/db/vacuum).")
+
+
+def _migrate_add_zone_id(conn, task_of_class):
+    """v5: add detections.zone_id (NULL for rows written before zones were recorded)."""
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(detections)")]
+    if "zone_id" not in cols:
+        conn.execute("ALTER TABLE detections ADD COLUMN zone_id TEXT")
+
+
+# PRAGMA user_version -> step that brings the database to that version
+MIGRATIONS = [
+    (1, _migrate_thumbnails_to_blobs),
+    (2, _migrate_add_ts),
+    (3, _migrate_backfill_rollups),
+    (4, _migrate_incremental_vacuum),
+    (5, _migrate_add_zone_id),
+]
+
+
+def _local_buckets(ts_ms):
+    """(minute, hour, day) bucket starts in local time, as epoch ms."""
+    minute = ts_ms - ts_ms % 60000
+    t = datetime.fromtimestamp(minute / 1000)
+    hour = int(t.replace(minute=0).timestamp() * 1000)
+    day = int(datetime.combine(t.date(), dtime.min).timestamp() * 1000)
+    return minute, hour, day
+
+
+def rollup_counts(items, task_of_class):
+    """Counter keyed by (table, bucket, label, class, task, zone_id) for (ts, label, class, zone_id) items."""
+    counts = Counter()
+    buckets = {}
+    for ts, label, cls, zone_id in items:
+        if ts is None:
+            continue
+        minute = ts - ts % 60000
+        if minute not in buckets:
+            buckets[minute] = _local_buckets(minute)
+        key = (label or "", cls or "", task_of_class.get(cls, ""), "" if zone_id is None else str(zone_id))
+        for table, bucket in zip(ROLLUP_TABLES.values(), buckets[minute]):
+            counts[(table, bucket, *key)] += 1
+    return counts
+
+
+def upsert_rollups(conn, counts):
+    by_table = {}
+    for (table, *key), n in counts.items():
+        by_table.setdefault(table, []).append((*key, n))
+    for table, rows in by_table.items():
+        conn.executemany(
+            f"""INSERT INTO {table} (bucket, label, class, task, zone_id, count)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(bucket, label, class, task, zone_id) DO UPDATE SET count = count + excluded.count""",
+            rows,
+        )
+
+
+def to_epoch_ms(value, end_of_day=False):
+    """
+    Parse a filter bound ("YYYY-MM-DD", "YYYY-MM-DD HH:MM[:SS]", ISO 8601 or
+    epoch ms) into epoch milliseconds. Naive values are local time. A bare
+    date used as an upper bound means the end of that day.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    text = str(value).strip()
+    dt = datetime.fromisoformat(text)
+    if end_of_day and len(text) == 10:
+        dt = datetime.combine(dt.date(), dtime.max)
+    return int(dt.timestamp() * 1000)
+
+
+def auto_vacuum_mode(conn):
+    """"none", "full" or "incremental" (what the file actually uses, not what was requested)."""
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    return {0: "none", 1: "full", 2: "incremental"}.get(mode, str(mode))
+
+
+def vacuum_db(conn):
+    """
+    One-off maintenance: rebuild the file with a full VACUUM, which also converts it
+    to auto_vacuum=INCREMENTAL. Blocks writers for its duration and needs free disk
+    space of about the database size.
+    """
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def migrate(conn, task_of_class):
+    """Bring an existing detections.db up to the current schema version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, step in MIGRATIONS:
+        if version < target:
+            print(f"[DB] Migrating detections.db to schema v{target}...")
+            step(conn, task_of_class)
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+            version = target
+
+
+def _event_row(event):
+    bbox = event.get("bbox") or [None, None, None, None]
+    x1, y1, x2, y2 = (int(b) if b is not None else None for b in bbox)
+    return (
+        event.get("label", ""),
+        event.get("type", ""),
+        int(event.get("track_id", -1)),
+        float(event.get("confidence", 0.0)),
+        x1, y1, x2, y2,
+        event.get("date", ""),
+        event.get("time", ""),
+        event.get("event", ""),
+        _event_ts(event),
+        None if event.get("zone_id") is None else str(event["zone_id"]),
+    )
+
+
+def _event_ts(event):
+    ts = event.get("ts")
+    if ts is not None:
+        return int(ts)
+    try:
+        return to_epoch_ms(f"{event.get('date', '')} {event.get('time', '')}")
+    except ValueError:
+        return None
+
+
+def _event_thumbnail(event):
+    """(mime, raw bytes) of an appear event's thumbnail, or None."""
+    thumb = event.get("thumbnail")
+    if not thumb:
+        return None
+    try:
+        data = base64.b64decode(thumb) if isinstance(thumb, str) else bytes(thumb)
+    except Exception:
+        return None
+    return event.get("mime") or "image/webp", data
+
+
+def _is_busy(error):
+    """True for SQLite's transient "database is locked/busy" errors."""
+    text = str(error).lower()
+    return "locked" in text or "busy" in text
+
+
+class DetectionWriter:
+    """
+    Dedicated SQLite writer thread for detection events.
+
+    `submit()` only enqueues; the thread flushes in one transaction whenever
+    `batch_size` events are buffered or `flush_interval` seconds have passed
+    since the first buffered one, so a busy shift costs one fsync per batch
+    instead of one per event.
+    """
+
+    def __init__(self, path, task_of_class=None, batch_size=500, flush_interval=0.5, max_queue=100_000,
+                 retry_interval=1.0):
+        self.task_of_class = task_of_class or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval  # seconds between attempts while the database is locked
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._conn = open_db(path)
+        self._stop = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.retries = 0  # flushes put off because the database was locked
+        self.last_batch = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # a locked database (e.g. a full VACUUM running) keeps the batch; new events wait in the queue
+            while not self._flush(batch, final=self._stop.is_set()):
+                self._stop.wait(self.retry_interval)
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+    def _flush(self, batch, final=False):
+        """
+        Write one batch in one transaction. Returns False (batch kept, nothing
+        counted) when the database is busy/locked and the caller should retry,
+        unless `final`.
+        """
+        t0 = time.perf_counter()
+        insert = """INSERT INTO detections
+                      (label, class, track_id, confidence, x1, y1, x2, y2, date, time, event, ts, zone_id)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+        try:
+            plain = []
+            with self._conn:
+                for e in batch:
+                    thumb = _event_thumbnail(e)
+                    if thumb is None:
+                        plain.append(_event_row(e))
+                        continue
+                    # need the row id to key the thumbnail
+                    cur = self._conn.execute(insert, _event_row(e))
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO detection_thumbnails (detection_id, mime, data) VALUES (?, ?, ?)",
+                        (cur.lastrowid, *thumb),
+                    )
+                if plain:
+                    self._conn.executemany(insert, plain)
+                # rollups count each tracked object once, on its appear event
+                upsert_rollups(self._conn, rollup_counts(
+                    ((_event_ts(e), e.get("label"), e.get("type"), e.get("zone_id"))
+                     for e in batch if e.get("event") == "appear"),
+                    self.task_of_class,
+                ))
+            ok = True
+        except sqlite3.OperationalError as e:
+            if not final and _is_busy(e):
+                with self._stats_lock:
+                    self.retries += 1
+                return False
+            print(f"[DB] batch insert of {len(batch)} failed: {e}")
+            ok = False
+        except Exception as e:
+            print(f"[DB] batch insert of {len(batch)} failed: {e}")
+            ok = False
+        ms = (time.perf_counter() - t0) * 1000
+        with self._stats_lock:
+            self.flushes += 1
+            self.last_batch = len(batch)
+            self.last_flush_ms = ms
+            self.max_flush_ms = max(self.max_flush_ms, ms)
+            self._flush_ms_total += ms
+            if ok:
+                self.written += len(batch)
+            else:
+                self.failed += len(batch)
+        return True
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "retries": self.retries,
+                "flushes": self.flushes,
+                "last_batch": self.last_batch,
+                "last_flush_ms": round(self.last_flush_ms, 2),
+                "max_flush_ms": round(self.max_flush_ms, 2),
+                "avg_flush_ms": round(self._flush_ms_total / self.flushes, 2) if self.flushes else 0.0,
+            }
+
+    def close(self, timeout=5):
+        """Flush what's buffered and stop the thread."""
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+class RetentionPruner:
+    """
+    Background thread that enforces `retention` (days per table, see
+    EXAMPLE_RETENTION) on detections.db. Tables not listed keep everything.
+
+    Old rows are deleted `batch_size` at a time, each batch in its own short
+    transaction on the pruner's own connection, with a pause in between so the
+    writer thread and readers never wait long on the SQLite lock. Freed pages
+    are then returned with a bounded `PRAGMA incremental_vacuum` once the file
+    uses auto_vacuum=INCREMENTAL; until then they are just reused by SQLite.
+    The full VACUUM that converts an existing file only runs when requested
+    with request_vacuum().
+    """
+
+    def __init__(self, path, retention=None, interval=600, batch_size=2000, pause=0.05, vacuum_pages=1000):
+        self.retention = dict(DEFAULT_RETENTION)
+        self.retention.update(retention or {})
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self._conn = open_db(path)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._vacuum_requested = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self.deleted = {}
+        self.vacuumed_pages = 0
+        self.last_run = None
+        self.last_run_ms = 0.0
+        self.auto_vacuum = auto_vacuum_mode(self._conn)
+        self.vacuum_status = None  # None | "queued" | "running" | "done" | "failed: ..."
+        self.last_vacuum_ms = None
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _cutoff(self, key, now_ms):
+        days = self.retention.get(key)
+        if days is None:
+            return None
+        return now_ms - int(days * 86400_000)
+
+    def _delete_batches(self, key, sql, args):
+        """Run a `... LIMIT ?` delete until it stops matching; returns rows removed."""
+        total = 0
+        while not self._stop.is_set():
+            with self._conn:
+                n = self._conn.execute(sql, (*args, self.batch_size)).rowcount
+            total += n
+            if n < self.batch_size:
+                break
+            time.sleep(self.pause)
+        if total:
+            with self._stats_lock:
+                self.deleted[key] = self.deleted.get(key, 0) + total
+        return total
+
+    def _first_kept_id(self, cutoff_ms):
+        """Smallest detection id at/after the cutoff (ids follow insertion, hence time)."""
+        row = self._conn.execute(
+            "SELECT id FROM detections WHERE ts >= ? ORDER BY ts LIMIT 1", (cutoff_ms,)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        row = self._conn.execute("SELECT MAX(id) FROM detections").fetchone()
+        return (row[0] or 0) + 1
+
+    def prune_once(self):
+        t0 = time.perf_counter()
+        now_ms = int(time.time() * 1000)
+        if not any(days is not None for days in self.retention.values()):
+            return
+
+        for key in ROLLUP_TABLES.values():
+            cutoff = self._cutoff(key, now_ms)
+            if cutoff is not None:
+                self._delete_batches(
+                    key,
+                    # WITHOUT ROWID tables: batch on the primary key instead
+                    f"DELETE FROM {key} WHERE (bucket, label, class, task, zone_id) IN "
+                    f"(SELECT bucket, label, class, task, zone_id FROM {key} WHERE bucket < ? LIMIT ?)",
+                    (cutoff,),
+                )
+
+        # thumbnails go no later than the rows they belong to
+        cutoffs = [c for c in (self._cutoff("thumbnails", now_ms), self._cutoff("detections", now_ms)) if c is not None]
+        if cutoffs:
+            self._delete_batches(
+                "thumbnails",
+                "DELETE FROM detection_thumbnails WHERE detection_id IN "
+                "(SELECT detection_id FROM detection_thumbnails WHERE detection_id < ? LIMIT ?)",
+                (self._first_kept_id(max(cutoffs)),),
+            )
+
+        cutoff = self._cutoff("detections", now_ms)
+        if cutoff is not None:
+            self._delete_batches(
+                "detections",
+                "DELETE FROM detections WHERE id IN (SELECT id FROM detections WHERE ts < ? LIMIT ?)",
+                (cutoff,),
+            )
+
+        self._incremental_vacuum()
+        with self._stats_lock:
+            self.last_run = now_ms
+            self.last_run_ms = (time.perf_counter() - t0) * 1000
+
+    def _incremental_vacuum(self):
+        if self.auto_vacuum != "incremental":
+            return  # incremental_vacuum is a no-op until the file has been converted
+        while not self._stop.is_set():
+            free = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            pages = min(free, self.vacuum_pages)
+            # executescript steps the pragma to completion; a plain execute() frees a single page
+            self._conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            with self._stats_lock:
+                self.vacuumed_pages += pages
+            time.sleep(self.pause)
+
+    def request_vacuum(self):
+        """Queue the one-off full VACUUM (see vacuum_db) on the pruner thread."""
+        with self._stats_lock:
+            if self.vacuum_status in ("queued", "running"):
+                return False
+            self.vacuum_status = "queued"
+        self._vacuum_requested.set()
+        self._wake.set()
+        return True
+
+    def _full_vacuum(self):
+        self._vacuum_requested.clear()
+        with self._stats_lock:
+            self.vacuum_status = "running"
+        t0 = time.perf_counter()
+        print("[DB] Running full VACUUM on detections.db...")
+        try:
+            vacuum_db(self._conn)
+            status = "done"
+        except Exception as e:
+            print(f"[DB] VACUUM failed: {e}")
+            status = f"failed: {e}"
+        mode = auto_vacuum_mode(self._conn)
+        with self._stats_lock:
+            self.auto_vacuum = mode
+            self.vacuum_status = status
+            self.last_vacuum_ms = round((time.perf_counter() - t0) * 1000, 2)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._vacuum_requested.is_set():
+                self._full_vacuum()
+            try:
+                self.prune_once()
+            except Exception as e:
+                print(f"[DB] retention pass failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "retention_days": dict(self.retention),
+                "deleted": dict(self.deleted),
+                "vacuumed_pages": self.vacuumed_pages,
+                "last_run": self.last_run,
+                "last_run_ms": round(self.last_run_ms, 2),
+                "auto_vacuum": self.auto_vacuum,
+                "vacuum": self.vacuum_status,
+                "last_vacuum_ms": self.last_vacuum_ms,
+            }
+
+    def close(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
@@ -0,0 +1,243 @@
+import threading
+import asyncio
+import struct
+import time
+
+from multiprocessing import shared_memory
+
+# Ring header: latest seq, publish time (epoch s), slot count, slot capacity
+_HEADER = struct.Struct("<QdII")
+# Slot header: seq held by the slot (0 while being written), payload length
+_SLOT_HEADER = struct.Struct("<QI")
+_SLOT_HEADER_SIZE = 16
+
+
+class FrameRing:
+    """
+    Per-camera ring of encoded frames in `multiprocessing.shared_memory`.
+
+    The camera process publishes each JPEG into the next slot and bumps the
+    sequence number in the header; readers in the API process look up the
+    latest slot and get a zero-copy `memoryview` over it. Slots are
+    seqlock-style: a reader re-checks the slot seq after using the view to
+    make sure the writer did not lap it in the meantime.
+    """
+
+    def __init__(self, shm, owner=False):
+        self._shm = shm
+        self._owner = owner
+        self._closed = False
+        _, _, self.slots, self.slot_capacity = _HEADER.unpack_from(shm.buf, 0)
+        self._seq = self.seq
+
+    @classmethod
+    def create(cls, slots=4, slot_capacity=1 << 20):
+        """Allocate a new ring (API process side)."""
+        size = _HEADER.size + slots * (_SLOT_HEADER_SIZE + slot_capacity)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, 0, 0.0, slots, slot_capacity)
+        for i in range(slots):
+            _SLOT_HEADER.pack_into(shm.buf, cls._slot_offset_for(i, slot_capacity), 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Open an existing ring by name (camera process side)."""
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @staticmethod
+    def _slot_offset_for(index, slot_capacity):
+        return _HEADER.size + index * (_SLOT_HEADER_SIZE + slot_capacity)
+
+    def _slot_offset(self, seq):
+        return self._slot_offset_for(seq % self.slots, self.slot_capacity)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def seq(self):
+        """Sequence number of the latest published frame (0 = none yet)."""
+        if self._closed:
+            return 0
+        return _HEADER.unpack_from(self._shm.buf, 0)[0]
+
+    @property
+    def timestamp(self):
+        """Epoch time of the latest publish (0.0 = none yet)."""
+        if self._closed:
+            return 0.0
+        return _HEADER.unpack_from(self._shm.buf, 0)[1]
+
+    # ---------------- writer -----------------
+    def publish(self, data):
+        """Copy one encoded frame into the next slot. Returns the new seq, or 0 if it doesn't fit."""
+        view = memoryview(data).cast("B")
+        n = view.nbytes
+        if n > self.slot_capacity:
+            return 0
+        seq = self._seq + 1
+        off = self._slot_offset(seq)
+        buf = self._shm.buf
+        _SLOT_HEADER.pack_into(buf, off, 0, 0)
+        start = off + _SLOT_HEADER_SIZE
+        buf[start:start + n] = view
+        _SLOT_HEADER.pack_into(buf, off, seq, n)
+        struct.pack_into("<Qd", buf, 0, seq, time.time())
+        self._seq = seq
+        return seq
+
+    # ---------------- readers -----------------
+    def latest(self):
+        """
+        Return (seq, memoryview) for the newest frame without copying, or (0, None).
+        The caller must release() the view and should check `is_current(seq)`
+        after consuming it.
+        """
+        seq = self.seq
+        if not seq:
+            return 0, None
+        off = self._slot_offset(seq)
+        slot_seq, n = _SLOT_HEADER.unpack_from(self._shm.buf, off)
+        if slot_seq != seq:
+            return 0, None
+        start = off + _SLOT_HEADER_SIZE
+        return seq, self._shm.buf[start:start + n]
+
+    def is_current(self, seq):
+        """True while the slot for `seq` has not been overwritten."""
+        if self._closed or not seq:
+            return False
+        return _SLOT_HEADER.unpack_from(self._shm.buf, self._slot_offset(seq))[0] == seq
+
+    def read_bytes(self, retries=3):
+        """Copy out the newest frame as (seq, bytes), or (0, None) if nothing is available."""
+        for _ in range(retries):
+            if self._closed:
+                break
+            seq, view = self.latest()
+            if view is None:
+                continue
+            with view:
+                data = bytes(view)
+            if self.is_current(seq):
+                return seq, data
+        return 0, None
+
+    # ---------------- lifecycle -----------------
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._shm.close()
+        except BufferError:
+            # A reader still holds a view; the mapping goes away with it.
+            pass
+
+    def unlink(self):
+        self.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class FrameHub:
+    """
+    Fans one camera's FrameRing out to any number of viewers in this process.
+
+    The camera process notifies `notify_cond` (a multiprocessing.Condition)
+    after every publish. A single pump thread wakes on it, copies the new
+    frame out of shared memory once (only while someone is watching) and
+    wakes the viewers, so N viewers cost one copy and one wakeup per frame.
+    Viewers are asyncio coroutines: each one waits on its own asyncio.Event,
+    set from the pump thread with call_soon_threadsafe, so a viewer never
+    holds a worker thread.
+    """
+
+    def __init__(self, ring, notify_cond, wrap=None, wait_timeout=1.0):
+        self._ring = ring
+        self._notify = notify_cond
+        self._wrap = wrap or (lambda data: data)
+        self._wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._frame = None
+        self._viewers = {}  # asyncio.Event -> its event loop
+        self._closed = False
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self):
+        seen = 0
+        while not self._closed:
+            with self._notify:
+                if not self._closed and self._ring.seq == seen:
+                    self._notify.wait(self._wait_timeout)
+            try:
+                seen = self._ring.seq
+                if not seen or not self._viewers:
+                    continue
+                seq, data = self._ring.read_bytes()
+            except (TypeError, ValueError):
+                # ring closed underneath us
+                break
+            if data is None:
+                continue
+            part = self._wrap(data)
+            with self._lock:
+                self._seq, self._frame = seq, part
+            self._wake()
+
+    def _wake(self):
+        with self._lock:
+            viewers = list(self._viewers.items())
+        for event, loop in viewers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def add_viewer(self):
+        """Register a viewer on the running event loop; returns its wakeup event."""
+        event = asyncio.Event()
+        with self._lock:
+            self._viewers[event] = asyncio.get_running_loop()
+        return event
+
+    def remove_viewer(self, event):
+        with self._lock:
+            self._viewers.pop(event, None)
+            if not self._viewers:
+                self._frame = None  # don't hand a stale frame to the next viewer
+
+    def _latest(self, after_seq):
+        with self._lock:
+            if self._closed or self._frame is None or self._seq <= after_seq:
+                return after_seq, None
+            return self._seq, self._frame
+
+    async def wait_frame(self, event, after_seq, timeout=1.0):
+        """
+        Wait for a frame newer than `after_seq` (`event` as returned by add_viewer()).
+        Returns (seq, frame), or (after_seq, None) on timeout/close.
+        """
+        seq, frame = self._latest(after_seq)
+        if frame is not None or self._closed:
+            return seq, frame
+        # clear before re-checking: a frame published after this still sets the event
+        event.clear()
+        seq, frame = self._latest(after_seq)
+        if frame is not None:
+            return seq, frame
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._latest(after_seq)
+
+    def close(self):
+        self._closed = True
+        self._wake()
@@ -0,0 +1,284 @@
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from utils import resource_path
+from types import SimpleNamespace
+import numpy as np
+import queue
+import time
+import yaml
+import os
+
+from ultralytics import YOLO
+from ultralytics.engine.results import Boxes
+from ultralytics.trackers.byte_tracker import BYTETracker
+
+TRACKER_YAML = resource_path("Ressources/bytetrack.yaml")
+YOLO_WEIGHTS = resource_path("Ressources/yolov8n.pt")
+
+# Largest frame a camera can hand to the inference server (640 px wide, up to 1:3 portrait)
+MAX_FRAME_BYTES = 640 * 1920 * 3
+
+
+def _empty_boxes(shape, cols=6):
+    return Boxes(np.zeros((0, cols), dtype=np.float32), shape[:2])
+
+
+def _as_numpy(data):
+    return data.cpu().numpy() if hasattr(data, "cpu") else np.asarray(data)
+
+
+def _shift(dets, dx, dy):
+    """Move N x (>=4) xyxy detections from crop to frame coordinates."""
+    dets = np.array(dets, dtype=np.float32, copy=True)
+    if len(dets):
+        dets[:, [0, 2]] += dx
+        dets[:, [1, 3]] += dy
+    return dets
+
+
+def _roi_crop(frame, roi, imgsz):
+    """
+    Crop `frame` to `roi` (x0, y0, x1, y1) and pick the inference size for it:
+    the crop's long side rounded up to a stride of 32, never above `imgsz`.
+    """
+    x0, y0, x1, y1 = roi
+    crop = np.ascontiguousarray(frame[y0:y1, x0:x1])
+    side = max(crop.shape[:2])
+    return crop, min(imgsz, max(32, -(-side // 32) * 32))
+
+
+def _load_tracker():
+    """A fresh BYTETracker from TRACKER_YAML, or None when the config is missing (no ids)."""
+    if not os.path.isfile(TRACKER_YAML):
+        return None
+    with open(TRACKER_YAML, "r", encoding="utf-8") as f:
+        return BYTETracker(SimpleNamespace(**yaml.safe_load(f)), frame_rate=30)
+
+
+def _track(tracker, dets, frame):
+    """Feed raw N x [x1, y1, x2, y2, conf, cls] frame-coordinate detections to `tracker`; returns Boxes."""
+    det_boxes = Boxes(dets, frame.shape[:2])
+    if tracker is None:
+        return det_boxes
+    tracks = tracker.update(det_boxes, frame)
+    if len(tracks) == 0:
+        return _empty_boxes(frame.shape, cols=7)
+    # tracks: x1, y1, x2, y2, id, score, cls, idx -> Boxes with .id
+    return Boxes(tracks[:, :-1], frame.shape[:2])
+
+
+def _predicted_boxes(tracker, alpha):
+    """
+    {track_id: (x1, y1, x2, y2)} of the tracker's confirmed tracks, moved `alpha`
+    tracker updates ahead along their Kalman velocity. ByteTrack's state is
+    (cx, cy, aspect, h) plus velocities; the tracker itself is left untouched.
+    """
+    out = {}
+    for track in getattr(tracker, "tracked_stracks", None) or ():
+        mean = getattr(track, "mean", None)
+        if mean is None or not getattr(track, "is_activated", False):
+            continue
+        cx, cy, aspect, h = np.asarray(mean[:4], dtype=np.float64) + alpha * np.asarray(mean[4:8], dtype=np.float64)
+        w = aspect * h
+        out[int(track.track_id)] = (cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2)
+    return out
+
+
+class LocalDetector:
+    """
+    One YOLO model inside the camera process. Like RemoteDetector, tracking runs
+    on its own BYTETracker in frame coordinates, so ids survive ROI changes.
+    """
+
+    def __init__(self, label, imgsz=640):
+        self.label = label
+        self.imgsz = imgsz
+        self.model = YOLO(YOLO_WEIGHTS)
+        try:
+            _ = self.model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+        except Exception:
+            pass
+        self.names = self.model.names
+        self._tracker = _load_tracker()
+
+    def detect(self, frame, roi=None):
+        """
+        Run inference/tracking on one frame and return its Boxes (with ids when tracking).
+        With `roi` (x0, y0, x1, y1) only that crop is inferred, at a matching imgsz,
+        and boxes are mapped back to frame coordinates before tracking.
+        """
+        imgsz = self.imgsz
+        src = frame
+        if roi is not None:
+            src, imgsz = _roi_crop(frame, roi, imgsz)
+        try:
+            # conf=0.1 matches Ultralytics' track() default so ByteTrack sees low-score boxes too
+            results = self.model.predict(source=src, imgsz=imgsz, conf=0.1, verbose=False, stream=False)[0]
+        except Exception as e:
+            print(f"[WORKER] '{self.label}' predict() error: {e}")
+            return None
+        dets = _as_numpy(results.boxes.data)
+        if roi is not None:
+            dets = _shift(dets, roi[0], roi[1])
+        return _track(self._tracker, dets, frame)
+
+    def predict_tracks(self, alpha):
+        """Track boxes extrapolated `alpha` inference steps past the last detect() (see _predicted_boxes)."""
+        if self._tracker is None:
+            return {}
+        return _predicted_boxes(self._tracker, alpha)
+
+
+class RemoteDetector:
+    """
+    Camera-side client of the shared inference server.
+
+    The frame is copied into this camera's shared-memory input buffer, a
+    small request tuple goes on the common request queue, and the raw
+    detections come back on this camera's private pipe. Tracking stays in
+    the camera process with its own BYTETracker, so ids remain per camera.
+    """
+
+    def __init__(self, label, request_queue, response_conn, slot, input_name, imgsz=640, response_timeout=5.0):
+        self.label = label
+        self.imgsz = imgsz
+        self.names = None
+        self._requests = request_queue
+        self._conn = response_conn
+        self._slot = slot
+        self._input = shared_memory.SharedMemory(name=input_name)
+        self._timeout = response_timeout
+        self._seq = 0
+        self._tracker = _load_tracker()
+
+    def detect(self, frame, roi=None):
+        imgsz = self.imgsz
+        src = frame
+        if roi is not None:
+            src, imgsz = _roi_crop(frame, roi, imgsz)
+        if src.nbytes > self._input.size:
+            print(f"[WORKER] '{self.label}' frame {src.shape} too large for inference input buffer.")
+            return None
+        dst = np.ndarray(src.shape, dtype=np.uint8, buffer=self._input.buf)
+        dst[...] = src
+        del dst
+
+        self._seq += 1
+        self._requests.put((self._slot, self._input.name, src.shape, self._seq, self.names is None, imgsz))
+        while True:
+            if not self._conn.poll(self._timeout):
+                print(f"[WORKER] '{self.label}' inference server timed out.")
+                return None
+            seq, dets, names = self._conn.recv()
+            if names is not None:
+                self.names = names
+            if seq == self._seq:
+                break  # anything older is a late answer to a timed-out request
+
+        if roi is not None:
+            # track in frame coordinates so ids survive ROI changes
+            dets = _shift(dets, roi[0], roi[1])
+        return _track(self._tracker, dets, frame)
+
+    def predict_tracks(self, alpha):
+        """Track boxes extrapolated `alpha` inference steps past the last detect() (see _predicted_boxes)."""
+        if self._tracker is None:
+            return {}
+        return _predicted_boxes(self._tracker, alpha)
+
+    def close(self):
+        self._input.close()
+
+
+def _attach_input(cache, name, limit=64):
+    shm = cache.get(name)
+    if shm is not None:
+        cache.move_to_end(name)
+        return shm
+    shm = shared_memory.SharedMemory(name=name)
+    cache[name] = shm
+    while len(cache) > limit:
+        _, old = cache.popitem(last=False)
+        try:
+            old.close()
+        except BufferError:
+            pass
+    return shm
+
+
+def inference_server_worker(request_queue, response_conns, imgsz=640, batch_size=8, max_latency=0.02):
+    """
+    Shared inference process: collects frames from all cameras into one batch
+    (up to `batch_size`, waiting at most `max_latency` seconds after the first
+    request), runs a single forward pass and routes each camera's raw
+    detections (N x [x1, y1, x2, y2, conf, cls]) back over its pipe.
+    """
+    print(f"[INFERENCE] Server worker starting (batch={batch_size}, max_latency={max_latency}s)")
+    model = YOLO(YOLO_WEIGHTS)
+    try:
+        _ = model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+    except Exception:
+        pass
+    names = dict(model.names)
+    inputs = OrderedDict()  # shm name -> SharedMemory, attached lazily
+
+    running = True
+    while running:
+        try:
+            first = request_queue.get()
+        except (EOFError, OSError):
+            break
+        if first is None:
+            break
+
+        batch = [first]
+        deadline = time.monotonic() + max_latency
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                req = request_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if req is None:
+                running = False
+                break
+            batch.append(req)
+
+        # ROI requests come with their own imgsz; run one forward pass per distinct size
+        groups = {}
+        for i, req in enumerate(batch):
+            groups.setdefault(req[5] or imgsz, []).append(i)
+
+        payloads = [None] * len(batch)
+        for size, idxs in groups.items():
+            frames = []
+            for i in idxs:
+                _slot, input_name, shape = batch[i][:3]
+                shm = _attach_input(inputs, input_name)
+                frames.append(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf))
+            try:
+                # conf=0.1 matches Ultralytics' track() default so ByteTrack sees low-score boxes too
+                results = model.predict(frames, imgsz=size, conf=0.1, verbose=False)
+                for i, r in zip(idxs, results):
+                    payloads[i] = r.boxes.data.cpu().numpy()
+            except Exception as e:
+                print(f"[INFERENCE] Batch of {len(idxs)} failed: {e}")
+                results = None
+                for i in idxs:
+                    payloads[i] = np.zeros((0, 6), dtype=np.float32)
+            del results, frames  # drop views into the input buffers before they can be evicted
+
+        for (slot, _name, _shape, seq, want_names, _size), dets in zip(batch, payloads):
+            try:
+                response_conns[slot].send((seq, dets, names if want_names else None))
+            except (BrokenPipeError, OSError):
+                pass
+
+    for shm in inputs.values():
+        try:
+            shm.close()
+        except BufferError:
+            pass
+    print("[INFERENCE] Server worker stopped.")
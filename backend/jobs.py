@@ -0,0 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import hashlib
+import uuid
+import time
+import os
+
+
+class JobRunner:
+    """
+    Runs slow exports (PDF reports, CSV/Parquet/Arrow dumps) on a small thread
+    pool so request handlers return immediately. Each job writes one file into
+    `job_dir`; finished jobs and their files are forgotten after `keep_sec`.
+
+    Jobs submitted with a cache `key` (e.g. the export's filter parameters) are
+    reused: the same key returns the running job, or the file already on disk
+    while it is younger than `keep_sec`, including across restarts.
+    """
+
+    def __init__(self, job_dir, max_workers=2, keep_sec=3600):
+        self.job_dir = job_dir
+        self.keep_sec = keep_sec
+        os.makedirs(job_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = {}  # id -> job dict (see get())
+        self._by_key = {}  # cache key -> job id
+
+    def submit(self, kind, build, filename, media_type, key=None):
+        """
+        Queue `build(path, progress)`, which must write the result to `path` and may
+        call `progress(fraction)`. Returns the job id (possibly an existing one for `key`).
+        """
+        self._expire()
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] if key is not None else None
+        with self._lock:
+            if key is not None:
+                job = self._jobs.get(self._by_key.get(key))
+                if job is not None and job["status"] != "failed":
+                    return job["id"]
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            job = {
+                "id": job_id,
+                "kind": kind,
+                "status": "queued",  # queued | running | done | failed
+                "progress": 0.0,
+                "cached": False,
+                "created": now,
+                "started": None,
+                "finished": None,
+                "error": None,
+                "size": None,
+                "filename": filename,
+                "media_type": media_type,
+                "path": os.path.join(self.job_dir, f"{digest or job_id}-{filename}"),
+            }
+            self._jobs[job_id] = job
+            if key is not None:
+                self._by_key[key] = job_id
+                try:
+                    mtime = os.path.getmtime(job["path"])
+                except OSError:
+                    mtime = None
+                if mtime is not None and now - mtime < self.keep_sec:
+                    # finished by an earlier process; keep its original age for expiry
+                    job.update(status="done", progress=1.0, cached=True, started=mtime, finished=mtime,
+                               size=os.path.getsize(job["path"]))
+                    return job_id
+        self._pool.submit(self._run, job, build)
+        return job_id
+
+    def _run(self, job, build):
+        with self._lock:
+            job["status"] = "running"
+            job["started"] = time.time()
+
+        def progress(fraction):
+            with self._lock:
+                job["progress"] = round(min(max(float(fraction), 0.0), 1.0), 3)
+
+        tmp = job["path"] + f".{job['id']}.part"
+        try:
+            build(tmp, progress)
+            os.replace(tmp, job["path"])
+            size = os.path.getsize(job["path"])
+            with self._lock:
+                job["status"] = "done"
+                job["progress"] = 1.0
+                job["size"] = size
+        except Exception as e:
+            print(f"[JOBS] {job['kind']} job {job['id']} failed: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            with self._lock:
+                job["status"] = "failed"
+                job["error"] = str(e)
+        finally:
+            with self._lock:
+                job["finished"] = time.time()
+
+    def get(self, job_id):
+        """Public view of a job (no filesystem path), or None if unknown/expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: v for k, v in job.items() if k != "path"}
+
+    def result(self, job_id):
+        """(path, filename, media_type) of a finished job, else None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != "done":
+                return None
+            return job["path"], job["filename"], job["media_type"]
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            old = [j for j in self._jobs.values() if j["finished"] and now - j["finished"] > self.keep_sec]
+            for job in old:
+                del self._jobs[job["id"]]
+            for key, job_id in list(self._by_key.items()):
+                if job_id not in self._jobs:
+                    del self._by_key[key]
+            live = {j["path"] for j in self._jobs.values()}
+        # also sweeps files left behind by earlier runs
+        for name in os.listdir(self.job_dir):
+            path = os.path.join(self.job_dir, name)
+            if path in live:
+                continue
+            try:
+                if now - os.path.getmtime(path) > self.keep_sec:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,10 +1,13 @@
-from fastapi.responses import StreamingResponse, Response, PlainTextResponse
-from fastapi import FastAPI, WebSocket, Query, HTTPException
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse, FileResponse
+from fastapi import FastAPI, WebSocket, Query, HTTPException, Request
 from starlette.websockets import WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from camera_manager import CameraManager
+from capture import CAPTURE_BACKENDS
+from subscriptions import EventSubscription
+from wire import require_format
 from typing import Optional, List
 from pydantic import BaseModel
 from logger import get_logger
@@ -53,6 +56,11 @@ app.add_middleware(
 class CameraInput(BaseModel):
     ip_address: str
     label: str
+    capture_backend: Optional[str] = None  # "opencv" | "ffmpeg"; None = server default
+    substream: Optional[str] = None  # low-res stream URL, or "auto" to derive it from ip_address
+    keyframes_only: bool = False  # decode keyframes only (ffmpeg backend)
+    hwaccel: Optional[str] = None  # e.g. "auto", "cuda", "vaapi", "qsv"
+    decode_threads: Optional[int] = None
 
 class ZoneInput(BaseModel):
     id: str
@@ -73,8 +81,18 @@ def add_camera(camera: CameraInput):
 
     if cameras.is_running(camera.label):
         raise HTTPException(status_code=409, detail=f"Camera '{camera.label}' already running.")
-    
-    threading.Thread(target=cameras.start_camera, args=(ip_or_file, camera.label)).start()
+    if camera.capture_backend is not None and camera.capture_backend not in CAPTURE_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"capture_backend must be one of {', '.join(CAPTURE_BACKENDS)}")
+
+    capture_options = {
+        "substream": camera.substream,
+        "keyframes_only": camera.keyframes_only,
+        "hwaccel": camera.hwaccel,
+        "decode_threads": camera.decode_threads,
+    }
+    if camera.capture_backend:
+        capture_options["backend"] = camera.capture_backend
+    threading.Thread(target=cameras.start_camera, args=(ip_or_file, camera.label, capture_options)).start()
     return {"status": "Started", "label": camera.label}
 
 @app.post("/api/stop_camera")
@@ -95,35 +113,107 @@ def set_zones(label: str, zones: List[ZoneInput]):
     return {"status": "Zones updated", "label": label, "count": len(zones)}
 
 # --- WebSocket handlers ---
-async def websocket_handler(websocket: WebSocket, client_add, client_remove):
-    await websocket.accept()
-    client_add(websocket)
+async def _drain_incoming(websocket: WebSocket):
+    """Read (and ignore) client messages, text or binary, so a closed socket is noticed right away."""
     try:
         while True:
-            await asyncio.sleep(60)
-    except WebSocketDisconnect:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    except (WebSocketDisconnect, RuntimeError):
         pass
+
+async def websocket_handler(websocket: WebSocket, client_add, client_remove):
+    await websocket.accept()
+    channel = client_add(websocket)
+    sender = asyncio.create_task(channel.run())
+    receiver = asyncio.create_task(_drain_incoming(websocket))
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
     finally:
         client_remove(websocket)
+        for task in (sender, receiver):
+            task.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
 
 @app.websocket("/ws/events")
 async def websocket_events(websocket: WebSocket):
-    await websocket_handler(websocket, cameras.add_client, cameras.remove_client)
+    """
+    Optional filters (comma-separated): labels, classes, zones, events (appear,update,disappear).
+    coalesce_ms=N sends updates as one {"event": "updates", "label", "updates": [...]} per camera every N ms.
+    format=msgpack sends binary MessagePack frames with thumbnails as raw bytes (default: JSON text).
+    """
+    try:
+        sub = EventSubscription.from_query(websocket.query_params)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    await websocket_handler(websocket, lambda ws: cameras.add_client(ws, sub), cameras.remove_client)
+
+async def _wire_format(websocket: WebSocket):
+    """?format=json|msgpack, or None after closing the socket on a bad value."""
+    try:
+        return require_format(websocket.query_params.get("format") or "json")
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return None
+
+def _wants_delta(websocket: WebSocket, default: bool):
+    value = websocket.query_params.get("delta")
+    if value is None:
+        return default
+    return value.lower() not in ("0", "false", "no")
 
 @app.websocket("/ws/counts")
 async def websocket_counts(websocket: WebSocket):
-    await websocket_handler(websocket, cameras.add_count_client, cameras.remove_count_client)
+    """Keyframe on join, then {"type": "delta", "seq", ...} with changed cameras only (?delta=0: full snapshots)."""
+    fmt = await _wire_format(websocket)
+    if fmt:
+        delta = _wants_delta(websocket, True)
+        await websocket_handler(
+            websocket, lambda ws: cameras.add_count_client(ws, fmt, delta), cameras.remove_count_client
+        )
 
 @app.websocket("/ws/counts-list")
 async def websocket_counts_list(websocket: WebSocket):
-    await websocket_handler(websocket, cameras.add_frontend_count_client, cameras.remove_frontend_count_client)
+    """Full snapshot whenever counts change (the dashboard's format); ?delta=1 for keyframe + deltas."""
+    fmt = await _wire_format(websocket)
+    if fmt:
+        delta = _wants_delta(websocket, False)
+        await websocket_handler(
+            websocket, lambda ws: cameras.add_frontend_count_client(ws, fmt, delta), cameras.remove_frontend_count_client
+        )
+
+@app.websocket("/ws/jobs/{job_id}")
+async def websocket_job(websocket: WebSocket, job_id: str):
+    """Push the job's status whenever it changes; closes once it is done or failed."""
+    await websocket.accept()
+    last = None
+    try:
+        while True:
+            job = cameras.jobs.get(job_id)
+            if job is None:
+                await websocket.send_json({"id": job_id, "status": "unknown"})
+                break
+            if job != last:
+                await websocket.send_json(job)
+                last = job
+            if job["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(0.25)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
 
 # --- MJPEG stream ---
 @app.get("/stream/{label}")
-def video_feed(label: str):
+async def video_feed(label: str, max_fps: Optional[float] = Query(None, gt=0)):
     if not cameras.is_running(label):
         raise HTTPException(status_code=404, detail=f"Camera '{label}' not running.")
-    return StreamingResponse(cameras.generate_frames(label), media_type="multipart/x-mixed-replace; boundary=frame")
+    return StreamingResponse(
+        cameras.generate_frames(label, max_fps=max_fps),
+        media_type="multipart/x-mixed-replace; boundary=frame",
+    )
 
 # --- Export routes ---
 @app.get("/api/export/csv")
@@ -131,11 +221,51 @@ def export_csv(
     start: Optional[str] = Query(None),
     end: Optional[str] = Query(None),
     label: Optional[str] = None,
-    cls: Optional[str] = Query(None, alias="class")
+    cls: Optional[str] = Query(None, alias="class"),
+    gzip: bool = Query(False),
 ):
-    csv_text = cameras.export_csv_text(start=start, end=end, label=label, cls=cls)
+    try:
+        chunks = cameras.export_csv_stream(gzip=gzip, start=start, end=end, label=label, cls=cls)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid start/end: {e}")
     headers = {"Content-Disposition": "attachment; filename=detections.csv"}
-    return Response(content=csv_text, media_type="text/csv; charset=utf-8", headers=headers)
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type="text/csv; charset=utf-8", headers=headers)
+
+COLUMNAR_MEDIA_TYPES = {
+    "parquet": ("application/vnd.apache.parquet", "detections.parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "detections.arrows"),
+}
+
+def _export_columnar(fmt, start, end, label, cls):
+    try:
+        chunks = cameras.export_columnar_stream(fmt, start=start, end=end, label=label, cls=cls)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid start/end: {e}")
+    except RuntimeError:
+        return PlainTextResponse(f"{fmt.capitalize()} export requires 'pyarrow'", status_code=501)
+    media_type, filename = COLUMNAR_MEDIA_TYPES[fmt]
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+@app.get("/api/export/parquet")
+def export_parquet(
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    label: Optional[str] = None,
+    cls: Optional[str] = Query(None, alias="class")
+):
+    return _export_columnar("parquet", start, end, label, cls)
+
+@app.get("/api/export/arrow")
+def export_arrow(
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    label: Optional[str] = None,
+    cls: Optional[str] = Query(None, alias="class")
+):
+    return _export_columnar("arrow", start, end, label, cls)
 
 @app.get("/api/export/pdf")
 def export_pdf(
@@ -146,11 +276,128 @@ def export_pdf(
 ):
     try:
         data = cameras.export_pdf_bytes(start=start, end=end, label=label, cls=cls)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid start/end: {e}")
     except RuntimeError:
         return PlainTextResponse("PDF export requires 'reportlab'", status_code=501)
     headers = {"Content-Disposition": "attachment; filename=detections.pdf"}
     return Response(content=data, media_type="application/pdf", headers=headers)
 
+@app.post("/api/export/{fmt}/job", status_code=202)
+def export_job(
+    fmt: str,
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    label: Optional[str] = None,
+    cls: Optional[str] = Query(None, alias="class"),
+    gzip: bool = Query(False),
+):
+    try:
+        job_id = cameras.start_export_job(fmt, gzip=gzip, start=start, end=end, label=label, cls=cls)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        return PlainTextResponse(f"{fmt.capitalize()} export is unavailable: {e}", status_code=501)
+    return {
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}",
+        "ws_url": f"/ws/jobs/{job_id}",
+        "download_url": f"/api/jobs/{job_id}/download",
+        "job": cameras.jobs.get(job_id),
+    }
+
+@app.get("/api/jobs/{job_id}")
+def job_status(job_id: str):
+    job = cameras.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+@app.get("/api/jobs/{job_id}/download")
+def job_download(job_id: str):
+    job = cameras.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    result = cameras.jobs.result(job_id)
+    if result is None:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}" + (f": {job['error']}" if job["error"] else ""))
+    path, filename, media_type = result
+    return FileResponse(path, media_type=media_type, filename=filename)
+
+@app.get("/api/camera_stats")
+def camera_stats():
+    return {"cameras": cameras.get_camera_stats()}
+
+@app.get("/api/ws_stats")
+def ws_stats():
+    return cameras.get_ws_stats()
+
+@app.get("/api/db_stats")
+def db_stats():
+    return cameras.get_db_stats()
+
+@app.post("/api/db/vacuum", status_code=202)
+def db_vacuum():
+    """Start the one-off full VACUUM in the background; progress shows up in /api/db_stats."""
+    queued = cameras.request_db_vacuum()
+    return {"status": "queued" if queued else "already queued", **cameras.get_db_stats()["retention"]}
+
+@app.get("/api/detections")
+def detections(
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    label: Optional[str] = None,
+    cls: Optional[str] = Query(None, alias="class"),
+    zone_id: Optional[str] = None,
+    track_id: Optional[int] = None,
+    fields: Optional[str] = Query(None, description="comma-separated column list"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    order: str = Query("desc"),
+    count_only: bool = Query(False),
+):
+    try:
+        return cameras.page_detections(
+            columns=[f for f in (fields or "").split(",") if f] or None,
+            limit=limit, cursor=cursor, order=order, count_only=count_only,
+            start=start, end=end, label=label, cls=cls, zone_id=zone_id, track_id=track_id,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/stats")
+def stats(
+    granularity: str = Query("hour"),
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    label: Optional[str] = None,
+    cls: Optional[str] = Query(None, alias="class"),
+    task: Optional[str] = None,
+    zone_id: Optional[str] = None,
+    group_by: Optional[str] = Query(None, description="comma-separated: label,class,task,zone_id"),
+):
+    try:
+        buckets = cameras.query_stats(
+            granularity, start=start, end=end, label=label, cls=cls, task=task, zone_id=zone_id,
+            group_by=tuple((group_by or "").split(",")),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"granularity": granularity, "buckets": buckets}
+
+@app.get("/api/thumbnail/{detection_id}")
+def thumbnail(detection_id: int, request: Request):
+    etag = f'"thumb-{detection_id}"'
+    # a detection's thumbnail never changes once written
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    thumb = cameras.get_thumbnail(detection_id)
+    if thumb is None:
+        raise HTTPException(status_code=404, detail=f"No thumbnail for detection {detection_id}.")
+    mime, data = thumb
+    return Response(content=data, media_type=mime, headers=headers)
+
 @app.get("/api/get_zones")
 def get_zones(label: str):
     return {"label": label, "zones": cameras.get_zones(label)}
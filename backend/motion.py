@@ -0,0 +1,79 @@
+import numpy as np
+import cv2
+
+
+class MotionGate:
+    """
+    Cheap motion check run before YOLO.
+
+    Works on a small blurred grayscale copy of the frame, either as a plain
+    difference against the previously checked frame ("diff") or through an
+    MOG2 background subtractor ("mog2"). `check()` returns True when the
+    fraction of changed pixels, optionally restricted to the camera's zones,
+    reaches `threshold`.
+    """
+
+    def __init__(self, width=160, threshold=0.002, pixel_delta=25, method="diff", zones_only=True):
+        self.width = width
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.method = method
+        self.zones_only = zones_only
+        self.last_score = 0.0
+
+        self._prev = None
+        self._bg = cv2.createBackgroundSubtractorMOG2(history=300, detectShadows=False) if method == "mog2" else None
+        self._zones = []
+        self._zone_mask = None
+        self._mask_key = None
+
+    def set_zones(self, zones):
+        """Zones as stored by CameraManager.set_zones (polygons in frame pixel coordinates)."""
+        if zones != self._zones:
+            self._zones = list(zones or [])
+            self._mask_key = None
+
+    def _small_gray(self, frame):
+        h, w = frame.shape[:2]
+        scale = self.width / float(w)
+        small = cv2.resize(frame, (self.width, max(1, int(round(h * scale)))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0), scale
+
+    def _mask_for(self, frame_shape, small_shape, scale):
+        key = (frame_shape[:2], small_shape)
+        if self._mask_key != key:
+            self._zone_mask = None
+            if self.zones_only and self._zones:
+                mask = np.zeros(small_shape, dtype=np.uint8)
+                for zone in self._zones:
+                    pts = np.round(np.array(zone["points"], np.float32) * scale).astype(np.int32)
+                    cv2.fillPoly(mask, [pts], 255)
+                self._zone_mask = mask
+            self._mask_key = key
+        return self._zone_mask
+
+    def check(self, frame):
+        gray, scale = self._small_gray(frame)
+        if self._bg is not None:
+            changed = self._bg.apply(gray)
+        else:
+            prev, self._prev = self._prev, gray
+            if prev is None or prev.shape != gray.shape:
+                self.last_score = 1.0
+                return True
+            _, changed = cv2.threshold(cv2.absdiff(prev, gray), self.pixel_delta, 255, cv2.THRESH_BINARY)
+
+        mask = self._mask_for(frame.shape, gray.shape, scale)
+        if mask is not None:
+            area = cv2.countNonZero(mask)
+            if not area:
+                self.last_score = 0.0
+                return False
+            moving = cv2.countNonZero(cv2.bitwise_and(changed, mask))
+        else:
+            area = changed.size
+            moving = cv2.countNonZero(changed)
+
+        self.last_score = moving / float(area)
+        return self.last_score >= self.threshold
@@ -0,0 +1,164 @@
+from datetime import datetime
+
+
+def require_reportlab():
+    try:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.units import cm
+    except Exception as e:
+        raise RuntimeError("reportlab not installed") from e
+    return A4, canvas, cm
+
+
+def _and(where_sql, cond):
+    return f"{where_sql} AND {cond}" if where_sql else f" WHERE {cond}"
+
+
+def report_summary(conn, where_sql, args):
+    """
+    Aggregates for the report header, all computed in SQL over the filtered rows.
+    "objects" counts appear events (one per tracked object), "rows" every logged event.
+    """
+    rows, objects, first_ts, last_ts = conn.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(event = 'appear'), 0), MIN(ts), MAX(ts) FROM detections{where_sql}",
+        args,
+    ).fetchone()
+    per_camera = conn.execute(
+        f"""SELECT label, SUM(event = 'appear'), COUNT(*) FROM detections{where_sql}
+            GROUP BY label ORDER BY 2 DESC, label""",
+        args,
+    ).fetchall()
+    per_class = conn.execute(
+        f"""SELECT class, SUM(event = 'appear'), COUNT(*) FROM detections{where_sql}
+            GROUP BY class ORDER BY 2 DESC, class""",
+        args,
+    ).fetchall()
+    hourly = [0] * 24
+    for hour, n in conn.execute(
+        f"""SELECT CAST(strftime('%H', ts / 1000, 'unixepoch', 'localtime') AS INTEGER), SUM(event = 'appear')
+            FROM detections{_and(where_sql, 'ts IS NOT NULL')} GROUP BY 1""",
+        args,
+    ):
+        if hour is not None:
+            hourly[hour] = n or 0
+    return {
+        "rows": rows,
+        "objects": objects,
+        "first_ts": first_ts,
+        "last_ts": last_ts,
+        "per_camera": per_camera,
+        "per_class": per_class,
+        "hourly": hourly,
+    }
+
+
+def _fmt_ts(ts):
+    return datetime.fromtimestamp(ts / 1000).strftime("%Y-%m-%d %H:%M:%S") if ts is not None else "-"
+
+
+class _PdfWriter:
+    """Small cursor over a reportlab canvas that starts a new page when it runs out of room."""
+
+    def __init__(self, out, A4, canvas, cm):
+        self.cm = cm
+        self.width, self.height = A4
+        self.c = canvas.Canvas(out, pagesize=A4, pageCompression=1)
+        self.y = self.height - 2 * cm
+
+    def need(self, space):
+        if self.y - space < 2 * self.cm:
+            self.c.showPage()
+            self.y = self.height - 2 * self.cm
+
+    def text(self, s, size=9, bold=False, step=0.5, x=2):
+        self.need(step * self.cm)
+        self.c.setFont("Helvetica-Bold" if bold else "Helvetica", size)
+        self.c.drawString(x * self.cm, self.y, s[:120])
+        self.y -= step * self.cm
+
+    def table(self, headers, rows, col_x):
+        self.need(1.2 * self.cm)
+        self.c.setFont("Helvetica-Bold", 9)
+        for h, x in zip(headers, col_x):
+            self.c.drawString(x * self.cm, self.y, h)
+        self.y -= 0.5 * self.cm
+        for r in rows:
+            self.need(0.45 * self.cm)
+            self.c.setFont("Helvetica", 9)
+            for v, x in zip(r, col_x):
+                self.c.drawString(x * self.cm, self.y, str(v if v is not None else "-")[:40])
+            self.y -= 0.45 * self.cm
+        self.y -= 0.4 * self.cm
+
+    def histogram(self, counts, height=4):
+        cm = self.cm
+        self.need((height + 1.2) * cm)
+        top = max(counts) or 1
+        left, bar_w = 2 * cm, (self.width - 4 * cm) / len(counts)
+        base = self.y - height * cm
+        self.c.setFont("Helvetica", 7)
+        for i, n in enumerate(counts):
+            h = (n / top) * (height - 0.5) * cm
+            self.c.rect(left + i * bar_w + 1, base, bar_w - 2, h, stroke=0, fill=1)
+            if n:
+                self.c.drawCentredString(left + (i + 0.5) * bar_w, base + h + 2, str(n))
+            self.c.drawCentredString(left + (i + 0.5) * bar_w, base - 10, f"{i:02d}")
+        self.y = base - 1 * cm
+
+    def save(self):
+        self.c.showPage()
+        self.c.save()
+
+
+def build_pdf_report(out, conn, where_sql="", args=(), title="Detections Report", appendix_limit=2000,
+                     progress=None):
+    """
+    Write the detections report for the filtered rows to `out` (path or binary file object):
+    SQL-computed summary tables and hourly histogram, then at most `appendix_limit` raw
+    rows streamed from the cursor. `progress(fraction)` is called while rendering, if given.
+    """
+    A4, canvas, cm = require_reportlab()
+    summary = report_summary(conn, where_sql, args)
+    pdf = _PdfWriter(out, A4, canvas, cm)
+
+    pdf.text(title, size=14, bold=True, step=0.8)
+    pdf.text(f"Period: {_fmt_ts(summary['first_ts'])}  to  {_fmt_ts(summary['last_ts'])}")
+    pdf.text(f"Objects (appearances): {summary['objects']}    Logged events: {summary['rows']}", step=0.9)
+
+    pdf.text("Per camera", size=11, bold=True, step=0.6)
+    pdf.table(["CAMERA", "OBJECTS", "EVENTS"], summary["per_camera"], [2, 9, 12])
+    pdf.text("Per class", size=11, bold=True, step=0.6)
+    pdf.table(["CLASS", "OBJECTS", "EVENTS"], summary["per_class"], [2, 9, 12])
+    pdf.text("Objects per hour of day", size=11, bold=True, step=0.6)
+    pdf.histogram(summary["hourly"])
+    if progress:
+        progress(0.2)
+
+    total = summary["rows"]
+    shown = min(total, appendix_limit)
+    pdf.c.showPage()
+    pdf.y = pdf.height - 2 * cm
+    pdf.text(f"Appendix: detections ({shown} of {total})", size=11, bold=True, step=0.7)
+    pdf.text("DATE | TIME | LABEL | CLASS | TRACK_ID | CONFIDENCE | EVENT", bold=True, step=0.6)
+    cur = conn.execute(
+        f"""SELECT date, time, label, class, track_id, confidence, event FROM detections{where_sql}
+            ORDER BY ts, id LIMIT ?""",
+        (*args, appendix_limit),
+    )
+    done = 0
+    while True:
+        chunk = cur.fetchmany(500)
+        if not chunk:
+            break
+        for date, time_, label, cls, track_id, conf, event in chunk:
+            pdf.text(f"{date} | {time_} | {label} | {cls} | {track_id} | {conf or 0:.2f} | {event}", step=0.45)
+        done += len(chunk)
+        if progress and shown:
+            progress(0.2 + 0.75 * done / shown)
+    if total > shown:
+        pdf.text(f"... {total - shown} more rows omitted; use the CSV/Parquet export for the full list.",
+                 bold=True, step=0.6)
+    pdf.save()
+    if progress:
+        progress(1.0)
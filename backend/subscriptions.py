@@ -0,0 +1,100 @@
+from typing import NamedTuple, Optional, FrozenSet
+from wire import require_format
+
+EVENT_TYPES = ("appear", "update", "disappear")
+
+
+def _csv_set(value):
+    items = frozenset(v.strip() for v in (value or "").split(",") if v.strip())
+    return items or None
+
+
+class EventSubscription(NamedTuple):
+    """
+    What one /ws/events client wants to receive. None means "no filter".
+    Hashable, so clients with identical filters share one serialization.
+    """
+    labels: Optional[FrozenSet[str]] = None
+    classes: Optional[FrozenSet[str]] = None
+    zones: Optional[FrozenSet[str]] = None
+    events: Optional[FrozenSet[str]] = None
+    coalesce_ms: int = 0  # >0: updates go out as one batched "updates" message per camera per tick
+    format: str = "json"  # wire format, see wire.WIRE_FORMATS
+
+    @classmethod
+    def from_query(cls, params):
+        """Build from websocket query params (comma-separated lists); raises ValueError."""
+        events = _csv_set(params.get("events"))
+        if events and not events <= set(EVENT_TYPES):
+            raise ValueError(f"events must be among {', '.join(EVENT_TYPES)}")
+        try:
+            coalesce_ms = int(params.get("coalesce_ms") or 0)
+        except ValueError:
+            raise ValueError("coalesce_ms must be an integer")
+        if coalesce_ms and not 20 <= coalesce_ms <= 10000:
+            raise ValueError("coalesce_ms must be between 20 and 10000")
+        return cls(
+            labels=_csv_set(params.get("labels")),
+            classes=_csv_set(params.get("classes")),
+            zones=_csv_set(params.get("zones")),
+            events=events,
+            coalesce_ms=coalesce_ms,
+            format=require_format(params.get("format") or "json"),
+        )
+
+    def matches(self, event):
+        if self.events is not None and event.get("event") not in self.events:
+            return False
+        if self.labels is not None and event.get("label") not in self.labels:
+            return False
+        if self.classes is not None and event.get("type") not in self.classes:
+            return False
+        if self.zones is not None and event.get("zone_id") not in self.zones:
+            return False
+        return True
+
+
+class UpdateCoalescer:
+    """
+    Per-subscription buffer for coalesced updates: keeps only the latest update
+    of each track per camera and turns them into one message per camera when
+    the subscription's tick is due.
+    """
+
+    def __init__(self, coalesce_ms):
+        self.interval = coalesce_ms / 1000.0
+        self.next_due = 0.0
+        self._pending = {}  # label -> {track_id: event}
+
+    def add(self, event):
+        self._pending.setdefault(event["label"], {})[event["track_id"]] = event
+
+    def forget(self, label, track_id):
+        self._pending.get(label, {}).pop(track_id, None)
+
+    def flush(self, now):
+        """Batched "updates" messages if the tick is due, else []."""
+        if now < self.next_due:
+            return []
+        self.next_due = now + self.interval
+        out = []
+        for label, tracks in self._pending.items():
+            if not tracks:
+                continue
+            out.append({
+                "event": "updates",
+                "label": label,
+                "updates": [
+                    {
+                        "track_id": e["track_id"],
+                        "type": e.get("type"),
+                        "zone_id": e.get("zone_id"),
+                        "confidence": e.get("confidence"),
+                        "bbox": e.get("bbox"),
+                        "ts": e.get("ts"),
+                    }
+                    for e in tracks.values()
+                ],
+            })
+        self._pending = {}
+        return out
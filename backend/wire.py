@@ -0,0 +1,43 @@
+import base64
+import json
+
+try:
+    import orjson  # optional: several times faster than json.dumps
+except Exception:
+    orjson = None
+
+try:
+    import msgpack  # optional: enables ?format=msgpack on the websockets
+except Exception:
+    msgpack = None
+
+WIRE_FORMATS = ("json", "msgpack")
+
+
+def require_format(fmt):
+    """Validate a client's requested wire format; raises ValueError."""
+    if fmt not in WIRE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(WIRE_FORMATS)}")
+    if fmt == "msgpack" and msgpack is None:
+        raise ValueError("msgpack is not installed on the server")
+    return fmt
+
+
+def dumps_json(obj):
+    """JSON text; orjson when available (compact, UTF-8 like ensure_ascii=False)."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode(obj, fmt="json"):
+    """
+    Payload for one websocket message: str (text frame) for JSON, bytes (binary
+    frame) for MessagePack. Raw `thumbnail` bytes are base64'd for JSON only.
+    """
+    if fmt == "msgpack":
+        return msgpack.packb(obj, use_bin_type=True)
+    thumb = obj.get("thumbnail") if isinstance(obj, dict) else None
+    if isinstance(thumb, (bytes, bytearray, memoryview)):
+        obj = {**obj, "thumbnail": base64.b64encode(thumb).decode("ascii")}
+    return dumps_json(obj)
@@ -0,0 +1,159 @@
+from collections import deque, Counter
+import threading
+import asyncio
+import time
+
+_ALL = object()
+
+
+class ClientChannel:
+    """
+    Outgoing side of one websocket: a bounded queue drained by its own sender task,
+    so a slow client only ever delays itself.
+
+    When the queue is full the oldest droppable message (updates, counts) is
+    discarded to make room; appear/disappear-style messages are kept unless the
+    queue holds nothing else. A client is only considered too slow when messages
+    get dropped and its sender has not completed a send (nor emptied its queue)
+    for `max_stall_sec`, so bursts to a fast client never disconnect it. Closing
+    cancels the sender, which may be stuck in a send on a stalled connection.
+    """
+
+    def __init__(self, ws, max_queue=256, max_stall_sec=10.0):
+        self.ws = ws
+        self.max_queue = max_queue
+        self.max_stall_sec = max_stall_sec
+        self.dropped = 0  # messages, total
+        self.too_slow = False
+        self._queue = deque()  # (message, droppable)
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._task = None  # the sender task, once run() has started
+        self._last_progress = time.monotonic()  # last completed send, or last time the queue was empty
+
+    def offer(self, items):
+        """Queue (message, droppable) items without blocking (event loop thread only)."""
+        if self._closed:
+            return
+        if not self._queue:
+            # a backlog starts now; stalls are measured from here, not from the last idle moment
+            self._last_progress = time.monotonic()
+        dropped = 0
+        for message, droppable in items:
+            if len(self._queue) >= self.max_queue:
+                dropped += 1
+                victim = next((i for i, (_, d) in enumerate(self._queue) if d), None)
+                if victim is None:
+                    if droppable:
+                        continue
+                    victim = 0
+                del self._queue[victim]
+            self._queue.append((message, droppable))
+        self._ready.set()
+        if dropped:
+            self.dropped += dropped
+            if time.monotonic() - self._last_progress >= self.max_stall_sec:
+                print(f"[WS] Disconnecting slow client ({self.dropped} messages dropped).")
+                self.too_slow = True
+                self.close()
+
+    def close(self):
+        self._closed = True
+        self._queue.clear()
+        self._ready.set()
+        # a sender blocked in send() on a stalled connection would never see the flag
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    async def run(self):
+        """Sender loop; returns when the client goes away or is closed (cancelled) for being too slow."""
+        self._task = asyncio.current_task()
+        try:
+            while not self._closed:
+                if not self._queue:
+                    self._last_progress = time.monotonic()
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                message, _ = self._queue.popleft()
+                if isinstance(message, bytes):
+                    await self.ws.send_bytes(message)
+                else:
+                    await self.ws.send_text(message)
+                self._last_progress = time.monotonic()
+        except Exception:
+            pass
+        finally:
+            self._closed = True
+            if self.too_slow:
+                try:
+                    await asyncio.wait_for(self.ws.close(code=1013), 1.0)  # try again later
+                except Exception:
+                    pass
+
+
+class ClientGroup:
+    """
+    The websocket clients of one endpoint. `publish*()` may be called from any
+    thread: messages are handed to the event loop with call_soon_threadsafe and
+    offered to every client's queue there, never awaiting a send.
+
+    Clients may be added under a hashable `key` (e.g. their subscription), so a
+    publisher can render a message once per distinct key and publish it to
+    just those clients.
+    """
+
+    def __init__(self, loop, max_queue=256, max_stall_sec=10.0):
+        self.loop = loop
+        self.max_queue = max_queue
+        self.max_stall_sec = max_stall_sec
+        self._channels = {}  # ws -> (key, ClientChannel)
+        self._lock = threading.Lock()  # guards _key_counts, read from publisher threads
+        self._key_counts = Counter()
+
+    def __len__(self):
+        return len(self._channels)
+
+    def keys(self):
+        """Distinct keys of the connected clients."""
+        with self._lock:
+            return list(self._key_counts)
+
+    def add(self, ws, key=None):
+        channel = ClientChannel(ws, self.max_queue, self.max_stall_sec)
+        self._channels[ws] = (key, channel)
+        with self._lock:
+            self._key_counts[key] += 1
+        return channel
+
+    def remove(self, ws):
+        entry = self._channels.pop(ws, None)
+        if entry is None:
+            return
+        key, channel = entry
+        channel.close()
+        with self._lock:
+            self._key_counts[key] -= 1
+            if self._key_counts[key] <= 0:
+                del self._key_counts[key]
+
+    def publish(self, message, droppable=True):
+        self.publish_many([(message, droppable)])
+
+    def publish_many(self, items, key=_ALL):
+        """`items`: list of (message, droppable), for every client or only those added under `key`."""
+        if items and self._channels:
+            self.loop.call_soon_threadsafe(self._offer_all, items, key)
+
+    def _offer_all(self, items, key):
+        for channel_key, channel in list(self._channels.values()):
+            if key is _ALL or channel_key == key:
+                channel.offer(items)
+
+    def stats(self):
+        return {
+            "clients": len(self._channels),
+            "subscriptions": len(self.keys()),
+            "queued": sum(len(c._queue) for _, c in self._channels.values()),
+            "dropped": sum(c.dropped for _, c in self._channels.values()),
+        }
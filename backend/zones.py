@@ -0,0 +1,71 @@
+import numpy as np
+import cv2
+
+
+def zones_bbox(zones, frame_shape, margin=0):
+    """
+    Union bounding box (x0, y0, x1, y1) of all zone polygons, grown by `margin`
+    and clipped to the frame. Returns None when there are no usable zones.
+    """
+    pts = [p for zone in zones or [] for p in zone.get("points", [])]
+    if not pts:
+        return None
+    arr = np.asarray(pts, dtype=np.int32)
+    h, w = frame_shape[:2]
+    x0 = max(0, int(arr[:, 0].min()) - margin)
+    y0 = max(0, int(arr[:, 1].min()) - margin)
+    x1 = min(w, int(arr[:, 0].max()) + margin + 1)
+    y1 = min(h, int(arr[:, 1].max()) + margin + 1)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+
+class ZoneIndex:
+    """
+    A camera's zones compiled into a label-index raster.
+
+    Pixel value k + 1 means "inside zone k" (0 = outside every zone); where
+    zones overlap the first one in the list wins, as with the old per-zone
+    pointPolygonTest loop. The raster is built once per frame shape, so
+    classifying all detection centers of a frame is a single fancy-index.
+    """
+
+    def __init__(self, zones=None):
+        self.zones = list(zones or [])
+        self.ids = [zone["id"] for zone in self.zones]
+        self._polys = [np.asarray(zone["points"], np.int32).reshape(-1, 1, 2) for zone in self.zones]
+        self._raster = None
+        self._bbox = {}
+
+    def __bool__(self):
+        return bool(self.zones)
+
+    def raster(self, frame_shape):
+        h, w = frame_shape[:2]
+        if self._raster is None or self._raster.shape != (h, w):
+            dtype = np.uint8 if len(self._polys) < 255 else np.uint16
+            raster = np.zeros((h, w), dtype=dtype)
+            for k in range(len(self._polys) - 1, -1, -1):
+                cv2.fillPoly(raster, [self._polys[k]], k + 1)
+            self._raster = raster
+        return self._raster
+
+    def lookup(self, cx, cy, frame_shape):
+        """Zone index per point (-1 = outside all zones) for integer coordinate arrays cx, cy."""
+        cx = np.asarray(cx, dtype=np.intp)
+        cy = np.asarray(cy, dtype=np.intp)
+        out = np.full(cx.shape, -1, dtype=np.intp)
+        if not self.zones or not cx.size:
+            return out
+        raster = self.raster(frame_shape)
+        h, w = raster.shape
+        inside = (cx >= 0) & (cx < w) & (cy >= 0) & (cy < h)
+        out[inside] = raster[cy[inside], cx[inside]].astype(np.intp) - 1
+        return out
+
+    def bbox(self, frame_shape, margin=0):
+        key = (tuple(frame_shape[:2]), margin)
+        if key not in self._bbox:
+            self._bbox[key] = zones_bbox(self.zones, frame_shape, margin)
+        return self._bbox[key]